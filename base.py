@@ -17,25 +17,56 @@
 """Balparda's base library of util methods and classes."""
 
 import base64
+import binascii
+import bisect
 import bz2
+import collections
+import concurrent.futures
+import contextlib
 import functools
+import gc
 import hashlib
+import io
 import json
 import logging
+import math
+import mmap
+import operator
 import os
 import os.path
 import pickle  # nosec - this is a dangerous module!
 # import pdb
+import re
+import struct
+import threading
 import time
 import sys
-from typing import Any, Callable, Literal, Optional, Union
+from typing import Any, BinaryIO, Callable, Iterator, Literal, Optional, Union
 
+from cryptography import exceptions
 from cryptography.hazmat.primitives import ciphers
+from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.ciphers import algorithms, modes
-from cryptography.hazmat.primitives import hashes as hazmat_hashes
-from cryptography.hazmat.primitives.kdf import pbkdf2 as hazmat_pbkdf2
+from cryptography.hazmat.primitives.kdf import hkdf
 from PIL import Image
 
+try:
+  import numpy as np  # optional: if missing, the vectorized (array) methods are not available
+except ImportError:
+  np = None  # type: ignore
+try:
+  import orjson  # optional: if missing, the (much slower) json module does all JSON work
+except ImportError:
+  orjson = None  # type: ignore
+try:
+  import zstandard  # optional: if missing, the 'zstd' compression codec is not available
+except ImportError:
+  zstandard = None  # type: ignore
+try:
+  from lz4 import frame as lz4_frame  # optional: if missing, the 'lz4' codec is not available
+except ImportError:
+  lz4_frame = None  # type: ignore
+
 from baselib import bin_fernet
 
 __author__ = 'balparda@gmail.com (Daniel Balparda)'
@@ -53,17 +84,201 @@ _LOG_FORMATS: list[str] = [
     '%Y%m%d.%H:%M:%S',  # date format
 ]
 # example '20220209.14:16:47.667    INFO[SomeMethodName]: Some message'
+_LOG_FORMATTERS: tuple[logging.Formatter, logging.Formatter] = (  # (without, with) process name
+    logging.Formatter(fmt=_LOG_FORMATS[0], datefmt=_LOG_FORMATS[2]),
+    logging.Formatter(fmt=_LOG_FORMATS[1], datefmt=_LOG_FORMATS[2]))
+_STDERR_HANDLER: Optional[logging.Handler] = None  # the one added by StartStdErrLogging(), if any
+_ROOT_LOGGER: logging.Logger = logging.getLogger()  # the logger used by logging.info() & co.
 
 # user directory
 USER_DIRECTORY: str = os.path.expanduser('~/')
-PRIVATE_DIR: Callable[[str], str] = lambda p: '~/' + p[len(USER_DIRECTORY):] if p.startswith(USER_DIRECTORY) else p
+_USER_DIR_LEN: int = len(USER_DIRECTORY)
+_PRIVATE_DIR_CACHE_ENTRIES: int = 1024  # logs tend to mention the same few paths many times
+
+
+@functools.lru_cache(maxsize=_PRIVATE_DIR_CACHE_ENTRIES)
+def PrivateDir(p: str) -> str:
+  """Path `p` with the user directory, if it is a prefix, replaced by '~/' (for logging)."""
+  return '~/' + p[_USER_DIR_LEN:] if p.startswith(USER_DIRECTORY) else p
+
+
+PRIVATE_DIR: Callable[[str], str] = PrivateDir  # old name, kept for compatibility
 
 # time utils
 _TIME_FORMAT: str = '%Y/%b/%d-%H:%M:%S-UTC'
-STD_TIME_STRING: Callable[[Union[int, float]], str] = lambda t: (
-    time.strftime(_TIME_FORMAT, time.gmtime(t)) if t else '-')  # cspell:disable-line
-INT_TIME: Callable[[], int] = lambda: int(time.time())
-STR_TIME: Callable[[], str] = lambda: STD_TIME_STRING(INT_TIME())
+_TIME_STRING_CACHE_ENTRIES: int = 1024  # logs tend to format the same few timestamps many times
+_TIME_MONTHS: bytes = b'JanFebMarAprMayJunJulAugSepOctNovDec'  # same as '%b' in the C locale
+_TIME_ARRAY_RANGE: tuple[int, int] = (-30610224000, 253402300800)  # years 1000 to 9999 (4 digits)
+
+
+@functools.lru_cache(maxsize=_TIME_STRING_CACHE_ENTRIES)
+def _StdTimeStringCached(t: int) -> str:
+  """StdTimeString() for a whole second `t` (so cache hits are exact)."""
+  return time.strftime(_TIME_FORMAT, time.gmtime(t))
+
+
+def StdTimeString(t: Union[int, float]) -> str:
+  """Standard string for UNIX time `t`, like '2023/Feb/07-16:55:07-UTC'; '-' if `t` is zero."""
+  # gmtime() floors fractional seconds, so we do the same to make float `t` hit the cache
+  return _StdTimeStringCached(math.floor(t)) if t else '-'
+
+
+def IntTime(_time: Callable[[], float] = time.time) -> int:
+  """Current UNIX time, as an integer number of seconds."""
+  return int(_time())
+
+
+def StrTime() -> str:
+  """Current UNIX time, as a standard string (see StdTimeString())."""
+  return StdTimeString(IntTime())
+
+
+def StdTimeStrings(times: Any) -> Any:
+  """Vectorized StdTimeString(): standard strings for an array of UNIX times. Needs `numpy`.
+
+  Much faster (~5x) than calling StdTimeString() for each element of a large array: the civil
+  dates are computed with whole-array integer arithmetic and written straight into the bytes
+  of the output strings, so there is no per-element Python (or libc) work at all.
+
+  Args:
+    times: numpy array (or sequence) of UNIX times, int or float
+
+  Returns:
+    numpy array of str, same shape as `times`
+
+  Raises:
+    Error: numpy is not installed
+  """
+  if np is None:
+    raise Error('StdTimeStrings() needs the `numpy` module: pip install numpy')
+  times = np.asarray(times)
+  secs = np.floor(times).astype(np.int64).ravel()
+  if secs.size and (secs.min() < _TIME_ARRAY_RANGE[0] or secs.max() >= _TIME_ARRAY_RANGE[1]):
+    # years with other than 4 digits: rare, so we just go the slow way
+    return np.array([StdTimeString(t) for t in times.ravel().tolist()]).reshape(times.shape)
+  # days since epoch -> civil date, see: http://howardhinnant.github.io/date_algorithms.html
+  days, day_secs = np.divmod(secs, 86400)
+  days += 719468  # shift epoch to 0000-03-01
+  era = days // 146097
+  day_of_era = days - era * 146097
+  year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524
+                 - day_of_era // 146096) // 365
+  day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+  month_from_march = (5 * day_of_year + 2) // 153
+  day = day_of_year - (153 * month_from_march + 2) // 5 + 1
+  month = np.where(month_from_march < 10, month_from_march + 3, month_from_march - 9)
+  year = year_of_era + era * 400 + (month <= 2)
+  hour, minute_secs = np.divmod(day_secs, 3600)
+  minute, second = np.divmod(minute_secs, 60)
+  # write the 'YYYY/Mon/DD-HH:MM:SS-UTC' ASCII bytes (48 is ord('0'))
+  out = np.empty((secs.size, 24), dtype=np.uint8)
+  out[:] = np.frombuffer(b'0000/Mon/00-00:00:00-UTC', dtype=np.uint8)
+  for col, divisor in ((0, 1000), (1, 100), (2, 10), (3, 1)):
+    out[:, col] = 48 + (year // divisor) % 10
+  out[:, 5:8] = np.frombuffer(_TIME_MONTHS, dtype=np.uint8).reshape(12, 3)[month - 1]
+  for col, value in ((9, day), (12, hour), (15, minute), (18, second)):
+    out[:, col] = 48 + value // 10
+    out[:, col + 1] = 48 + value % 10
+  strings = out.view('S24').ravel().astype(str)
+  return np.where(times.ravel() == 0, '-', strings).reshape(times.shape)
+
+
+# old names, kept for compatibility
+STD_TIME_STRING: Callable[[Union[int, float]], str] = StdTimeString
+INT_TIME: Callable[[], int] = IntTime
+STR_TIME: Callable[[], str] = StrTime
+
+# monotonic high-resolution integer clock, for Timer
+_PERF_COUNTER_NS: Callable[[], int] = time.perf_counter_ns
+
+# static password key derivation (see DeriveKeyFromStaticPassword())
+_PASSWORD_SALT: bytes = b'\xda4,92\x80\x88\xf1\xc8\x18x@Q\x95*&'  # fixed salt: do NOT change!
+_PASSWORD_ITERATIONS: int = 1745202  # fixed iterations: do NOT change!
+_DERIVED_KEY_CACHE_ENTRIES: int = 4
+_DERIVED_KEY_CACHE_SECRET: bytes = os.urandom(32)  # per-process secret for the cache index hash
+_DERIVED_KEY_CACHE: collections.OrderedDict[bytes, bytes] = collections.OrderedDict()
+_DERIVED_KEY_CACHE_LOCK = threading.Lock()  # guards _DERIVED_KEY_CACHE (never held while deriving)
+
+# serialization encryption: first byte of AES-GCM data (Fernet data always starts with b'\x80')
+_AES_GCM_TAG: bytes = b'\x01'
+_AES_GCM_KEY_INFO: bytes = b'baselib serialization AES-256-GCM key'  # HKDF label: do NOT change!
+
+# encryption: number of keys for which we keep Fernet objects (and so key material) in memory
+_FERNET_CACHE_ENTRIES: int = 32
+
+# file hashing: size of the read buffer used to stream files through the hash
+_HASH_CHUNK_SIZE: int = 1024 * 1024  # 1Mb
+_HASH_MMAP_MIN_SIZE: int = 64 * 1024 * 1024  # 64Mb: larger files are memory mapped instead
+_HAS_FILE_DIGEST: bool = hasattr(hashlib, 'file_digest')  # Python 3.11+
+# image hashing: minimum size of the raw pixel blocks fed to the hash
+_IMAGE_HASH_BLOCK_SIZE: int = 1024 * 1024  # 1Mb: bounds the pixel data copied at a time
+# bytes hashing: only inputs up to this size are memoized, in a cache of at most this many entries
+_HASH_CACHE_MAX_DATA: int = 4096
+_HASH_CACHE_ENTRIES: int = 4096
+
+# serialization pickle protocol: 5 (Python 3.8+) hands large contiguous buffers (bytes, bytearray,
+# numpy arrays, ...) to the file object's write() as-is, so they reach the compressor without a copy
+_PICKLE_PROTOCOL: int = 5
+
+# StructCodec: struct module format codes for the supported field types
+_STRUCT_CODES: dict[Any, str] = {int: 'q', float: 'd', bool: '?'}
+
+# serialization compression codecs; on de-serialization the codec is detected from the magic bytes
+# the default codec is 'zstd' (much faster than bz2) if `zstandard` is installed, else 'bz2';
+# 'lz4' is much faster still, but compresses less: good for ephemeral data, like in pipes
+CompressionCodec = Literal['none', 'bz2', 'zstd', 'lz4']
+_CODEC_MODULES: dict[str, str] = {'zstd': 'zstandard', 'lz4': 'lz4'}  # codec: optional module
+_BZ2_LEVEL: int = 9  # 1 to 9
+_BZ2_MAGIC: bytes = b'BZh'
+_ZSTD_LEVEL: int = 3  # 1 to 22 (or negative, for very fast); 3 is the zstd library default
+_BZ2_BLOCK_SIZE: int = 900 * 1000  # input block size for parallel bz2: each will be one bz2 stream
+_BZ2_STREAM_START: re.Pattern[bytes] = re.compile(rb'BZh[1-9]1AY&SY')  # stream + 1st block header
+_COMPRESSION_POOL: Optional[concurrent.futures.ThreadPoolExecutor] = None  # see _CompressionPool()
+_ZSTD_MAGIC: bytes = b'\x28\xb5\x2f\xfd'
+_ZSTD_THREADS_MIN_SIZE: int = 4 * 1024 * 1024  # zstd worker threads only pay off above this size
+_ZSTD_IDLE_MAX: int = 4  # idle zstd compressors kept for reuse, per (level, threaded)
+_ZSTD_IDLE_COMPRESSORS: dict[tuple[int, bool], list[Any]] = {}  # see _ZstdCompressor
+_LZ4_LEVEL: int = 0  # 0 (fast) to 16; 3 and up is the much slower "high compression" mode
+_LZ4_MAGIC: bytes = b'\x04\x22\x4d\x18'
+_DATA_ERRORS: tuple[type[Exception], ...] = (  # raised by pickle/codecs for bad data
+    pickle.UnpicklingError, EOFError, ValueError, OSError) + (
+        () if zstandard is None else (zstandard.ZstdError,))
+_CODEC_LEVELS: dict[str, tuple[int, int]] = {  # codec: valid compression level range (inclusive)
+    'bz2': (1, 9), 'zstd': (-(1 << 17), 22), 'lz4': (0, 16)}
+
+# humanized sizes/times: the same values tend to be logged over and over, so results are cached
+# (typed, or 1 and 1.0 would share an entry); formatters are pre-bound; powers of 1024 have exact
+# reciprocals, so we multiply instead of divide, but other divisors must stay divisions or rounding
+# would change; the unit index is found by bisect (in C) on the thresholds, so no compare ladders
+_HUMANIZED_CACHE_ENTRIES: int = 4096
+_BYTE_UNITS: tuple[tuple[Callable[[float], str], float], ...] = (  # (formatter, reciprocal)
+    ('{:0.2f}b'.format, 1.0), ('{:0.2f}kb'.format, 1.0 / 1024.0),
+    ('{:0.2f}Mb'.format, 1.0 / 1024.0 ** 2), ('{:0.2f}Gb'.format, 1.0 / 1024.0 ** 3),
+    ('{:0.2f}Tb'.format, 1.0 / 1024.0 ** 4))
+_BYTE_THRESHOLDS: tuple[int, ...] = (1024, 1024 ** 2, 1024 ** 3, 1024 ** 4)
+_DECIMAL_UNITS: tuple[tuple[Callable[[float], str], float], ...] = (  # (formatter, divisor)
+    ('{:0.2f}'.format, 1.0), ('{:0.2f}k'.format, 1000.0), ('{:0.2f}M'.format, 1000.0 ** 2),
+    ('{:0.2f}G'.format, 1000.0 ** 3), ('{:0.2f}T'.format, 1000.0 ** 4))
+_DECIMAL_THRESHOLDS: tuple[int, ...] = (1000, 1000 ** 2, 1000 ** 3, 1000 ** 4)
+_FMT_MSECS: Callable[[float], str] = '{:0.3f} msecs'.format  # cspell:disable-line
+_SECONDS_UNITS: tuple[tuple[Callable[[float], str], float], ...] = (  # (formatter, divisor)
+    ('{:0.4f} secs'.format, 1.0), ('{:0.2f} secs'.format, 1.0), ('{:0.2f} mins'.format, 60.0),
+    ('{:0.2f} hours'.format, 60.0 * 60.0), ('{:0.2f} days'.format, 24.0 * 60.0 * 60.0))
+_SECONDS_THRESHOLDS: tuple[float, ...] = (1.0, 60.0, 60.0 * 60.0, 24.0 * 60.0 * 60.0)
+# vectorized (array) versions: (factor, True to multiply/False to divide, decimals, suffix) per
+# unit, same units and same arithmetic as above; a None factor means the (int) value is used as-is
+_ArrayUnits = tuple[tuple[Optional[float], bool, int, str], ...]
+_BYTE_ARRAY_UNITS: _ArrayUnits = (
+    (None, True, 0, 'b'), (1.0 / 1024.0, True, 2, 'kb'), (1.0 / 1024.0 ** 2, True, 2, 'Mb'),
+    (1.0 / 1024.0 ** 3, True, 2, 'Gb'), (1.0 / 1024.0 ** 4, True, 2, 'Tb'))
+_DECIMAL_ARRAY_UNITS: _ArrayUnits = (
+    (None, True, 0, ''), (1000.0, False, 2, 'k'), (1000.0 ** 2, False, 2, 'M'),
+    (1000.0 ** 3, False, 2, 'G'), (1000.0 ** 4, False, 2, 'T'))
+_SECONDS_ARRAY_UNITS: _ArrayUnits = (
+    (1000.0, True, 3, ' msecs'),  # cspell:disable-line
+    (1.0, False, 4, ' secs'), (1.0, False, 2, ' secs'), (60.0, False, 2, ' mins'),
+    (60.0 * 60.0, False, 2, ' hours'), (24.0 * 60.0 * 60.0, False, 2, ' days'))
+_ARRAY_EXACT_LIMIT: float = 2.0 ** 52  # scaled values must be below this for exact rounding
 
 # terminal colors; can be compounded, but always use TERM_END to go back to default
 TERM_END = '\033[0m'  # disables colors/styles in terminal text
@@ -107,67 +322,156 @@ def StartStdErrLogging(level: int = logging.INFO, log_process: bool = False) ->
   """Start logging to stderr.
 
   Should be called only once like  `if __name__ == '__main__': lib.StartStdErrLogging(); main()`.
+  If called again, the handler from the previous call is replaced, so logs are never duplicated.
 
   Args:
     level: (default logging.INFO) logging level to use
     log_process: (default False) If True will add process names to log strings (as in the process
         `multiprocessing.Process(name=[some_name])` call)
   """
+  global _STDERR_HANDLER  # pylint: disable=global-statement
   logger: logging.Logger = logging.getLogger()
   logger.setLevel(level)
-  handler = logging.StreamHandler(sys.stdout)
-  handler.setLevel(level)
-  formatter = logging.Formatter(
-      fmt=_LOG_FORMATS[1] if log_process else _LOG_FORMATS[0],
-      datefmt=_LOG_FORMATS[2])
-  handler.setFormatter(formatter)
-  logger.addHandler(handler)
+  if _STDERR_HANDLER is not None:
+    logger.removeHandler(_STDERR_HANDLER)
+  _STDERR_HANDLER = logging.StreamHandler(sys.stdout)
+  _STDERR_HANDLER.setLevel(level)
+  _STDERR_HANDLER.setFormatter(_LOG_FORMATTERS[1 if log_process else 0])
+  logger.addHandler(_STDERR_HANDLER)
+
 
+def JsonToString(obj: JsonType, human_readable: bool = True, fast: bool = False) -> str:
+  """Convert JSON to string, either compact or with indentation (human_readable True, default).
+
+  The human-readable form always comes from the json module (4-space indentation); the compact
+  form is the one from JsonToBytes(), including `fast`.
+  """
+  if human_readable:
+    return json.dumps(obj, indent=4)
+  return JsonToBytes(obj, fast=fast).decode('utf-8')
 
-def JsonToString(obj: JsonType, human_readable: bool = True) -> str:
-  """Convert JSON to string, either compact or with indentation (human_readable True, default)."""
-  return json.dumps(obj, indent=4 if human_readable else None)
 
+def JsonToBytes(obj: JsonType, fast: bool = False) -> bytes:
+  """Convert JSON to bytes.
 
-def JsonToBytes(obj: JsonType) -> bytes:
-  """Convert JSON to bytes."""
+  By default this is the json module's output. With `fast` True and `orjson` installed, orjson
+  is used instead: many times faster, and the output is the tightest JSON (no spaces after
+  separators, non-ASCII as UTF-8), but it is not exactly equivalent: NaN/Infinity become null,
+  and some types json rejects (UUID, Enum, datetime, dataclasses) are serialized. Only use it for
+  data known to be plain JSON. Things orjson won't take (non-string keys, integers beyond 64 bits)
+  still go through the json module.
+  """
+  if fast and orjson is not None:
+    try:
+      return orjson.dumps(obj)
+    except TypeError:
+      pass  # orjson.JSONEncodeError: let json deal with it
   return json.dumps(obj).encode('utf-8')
 
 
-def StringToJson(obj: str) -> JsonType:
-  """Convert string to JSON."""
+def StringToJson(obj: str, fast: bool = False) -> JsonType:
+  """Convert string to JSON.
+
+  By default this is the json module's parsing. With `fast` True and `orjson` installed, orjson
+  is used instead: many times faster, but integers beyond 64 bits become (imprecise) floats, so
+  only use it for data known not to have those. Things orjson rejects (NaN/Infinity) still go
+  through the json module.
+  """
+  if fast and orjson is not None:
+    try:
+      return orjson.loads(obj)
+    except orjson.JSONDecodeError:
+      pass  # maybe NaN/Infinity, that only json takes; if really invalid, json will raise
   return json.loads(obj)
 
 
-def BytesToJson(obj: bytes) -> JsonType:
-  """Convert bytes to JSON."""
+def BytesToJson(obj: bytes, fast: bool = False) -> JsonType:
+  """Convert bytes to JSON. For `fast` see StringToJson()."""
+  if fast and orjson is not None:
+    try:
+      return orjson.loads(obj)  # takes (and validates) the UTF-8 bytes directly
+    except orjson.JSONDecodeError:
+      pass  # same as in StringToJson()
   return json.loads(obj.decode('utf-8'))
 
 
+@functools.lru_cache(maxsize=_HASH_CACHE_ENTRIES)
+def _CachedBytesBinHash(data: bytes) -> bytes:
+  """SHA-256 hash of small bytes data, memoized. Use BytesBinHash()."""
+  return hashlib.sha256(data).digest()
+
+
 def BytesBinHash(data: bytes) -> bytes:
-  """SHA-256 hex hash of bytes data. Always a length 32 bytes."""
+  """SHA-256 hex hash of bytes data. Always a length 32 bytes.
+
+  Hashes of small (up to 4kb) immutable `bytes` are memoized in a bounded LRU cache, so repeated
+  calls with the same data (common when de-duplicating or indexing) are not recomputed.
+  """
+  if len(data) <= _HASH_CACHE_MAX_DATA and isinstance(data, bytes):
+    return _CachedBytesBinHash(data)
   return hashlib.sha256(data).digest()
 
 
 def BytesHexHash(data: bytes) -> str:
-  """SHA-256 hex hash of bytes data. Always a length 64 string (32 bytes, hexadecimal)."""
+  """SHA-256 hex hash of bytes data. Always a length 64 string (32 bytes, hexadecimal).
+
+  Memoized just like BytesBinHash().
+  """
+  if len(data) <= _HASH_CACHE_MAX_DATA and isinstance(data, bytes):
+    return _CachedBytesBinHash(data).hex()
   return hashlib.sha256(data).hexdigest()
 
 
 def FileHexHash(full_path: str) -> str:
   """SHA-256 hex hash of file on disk. Always a length 64 string (32 bytes, hexadecimal)."""
-  logging.info('Hashing file %r', full_path)
-  if not os.path.exists(full_path):
-    raise Error(f'File {full_path!r} not found for hashing')
-  with open(full_path, 'rb') as file_obj:
-    return BytesHexHash(file_obj.read())
+  if _ROOT_LOGGER.isEnabledFor(logging.INFO):
+    logging.info('Hashing file %r', full_path)
+  try:
+    file_obj = open(full_path, 'rb', buffering=0)  # pylint: disable=consider-using-with
+  except FileNotFoundError as err:  # no separate exists() check: saves a stat() per file
+    raise Error(f'File {full_path!r} not found for hashing') from err
+  with file_obj:
+    if os.fstat(file_obj.fileno()).st_size > _HASH_MMAP_MIN_SIZE:
+      # large file: map it and hash it in one call, that releases the GIL, while the kernel
+      # reads ahead aggressively (sequential access advice) to overlap I/O and hashing
+      with mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+          mapped_file.madvise(mmap.MADV_SEQUENTIAL)
+        return hashlib.sha256(mapped_file).hexdigest()
+    if _HAS_FILE_DIGEST:
+      # Python 3.11+: stdlib streaming of the file through the hash with a reusable buffer
+      return hashlib.file_digest(file_obj, hashlib.sha256).hexdigest()  # type: ignore
+    # stream the file through the hash using a single pre-allocated buffer, so memory use
+    # does not depend on the file size and no new bytes object is created per chunk
+    sha256 = hashlib.sha256()
+    buffer = memoryview(bytearray(_HASH_CHUNK_SIZE))
+    while (n_bytes := file_obj.readinto(buffer)):
+      sha256.update(buffer[:n_bytes])
+  return sha256.hexdigest()
 
 
 def ImageHexHash(img: Image.Image) -> str:
-  """SHA-256 hex hash of internal image data (ignores metadata!). Always a length 64 string."""
-  return BytesHexHash(img.tobytes())
-
+  """SHA-256 hex hash of internal image data (ignores metadata!). Always a length 64 string.
 
+  Same as hashing `img.tobytes()`, but large images are hashed in bands of rows (raw pixel data
+  is laid out row by row, so the bands' tobytes() add up to exactly the image's), so the full
+  (potentially huge) copy of the image buffer is never built. Only public PIL API is used, as the
+  hashes must never change.
+  """
+  img.load()
+  width, height = img.size
+  if not width or not height:
+    return hashlib.sha256(img.tobytes()).hexdigest()
+  rows: int = max(1, _IMAGE_HASH_BLOCK_SIZE // len(img.crop((0, 0, width, 1)).tobytes()))
+  if rows >= height:
+    return hashlib.sha256(img.tobytes()).hexdigest()  # small image: in one go
+  sha256 = hashlib.sha256()
+  for top in range(0, height, rows):
+    sha256.update(img.crop((0, top, width, min(top + rows, height))).tobytes())
+  return sha256.hexdigest()
+
+
+@functools.lru_cache(maxsize=_HUMANIZED_CACHE_ENTRIES, typed=True)
 def HumanizedBytes(inp_sz: int) -> str:
   """Return human-readable byte sizes.
 
@@ -184,15 +488,11 @@ def HumanizedBytes(inp_sz: int) -> str:
     raise Error(f'Input should be >=0 and got {inp_sz}')
   if inp_sz < 1024:
     return f'{inp_sz}b'
-  if inp_sz < 1024 * 1024:
-    return f'{(inp_sz / 1024.0):0.2f}kb'
-  if inp_sz < 1024 * 1024 * 1024:
-    return f'{(inp_sz / (1024.0 * 1024.0)):0.2f}Mb'
-  if inp_sz < 1024 * 1024 * 1024 * 1024:
-    return f'{(inp_sz / (1024.0 * 1024.0 * 1024.0)):0.2f}Gb'
-  return f'{(inp_sz / (1024.0 * 1024.0 * 1024.0 * 1024.0)):0.2f}Tb'
+  formatter, reciprocal = _BYTE_UNITS[bisect.bisect_right(_BYTE_THRESHOLDS, inp_sz)]
+  return formatter(inp_sz * reciprocal)
 
 
+@functools.lru_cache(maxsize=_HUMANIZED_CACHE_ENTRIES, typed=True)
 def HumanizedDecimal(inp_sz: int) -> str:
   """Return human-readable decimal-measured sizes.
 
@@ -209,13 +509,8 @@ def HumanizedDecimal(inp_sz: int) -> str:
     raise Error(f'Input should be >=0 and got {inp_sz}')
   if inp_sz < 1000:
     return str(inp_sz)
-  if inp_sz < 1000 * 1000:
-    return f'{(inp_sz / 1000.0):0.2f}k'
-  if inp_sz < 1000 * 1000 * 1000:
-    return f'{(inp_sz / (1000.0 * 1000.0)):0.2f}M'
-  if inp_sz < 1000 * 1000 * 1000 * 1000:
-    return f'{(inp_sz / (1000.0 * 1000.0 * 1000.0)):0.2f}G'
-  return f'{(inp_sz / (1000.0 * 1000.0 * 1000.0 * 1000.0)):0.2f}T'
+  formatter, divisor = _DECIMAL_UNITS[bisect.bisect_right(_DECIMAL_THRESHOLDS, inp_sz)]
+  return formatter(inp_sz / divisor)
 
 
 def HumanizedSeconds(inp_secs: Union[int, float]) -> str:
@@ -230,22 +525,199 @@ def HumanizedSeconds(inp_secs: Union[int, float]) -> str:
   Raises:
     Error: negative value
   """
+  if inp_secs.__class__ is int:  # not for floats: timings (for example) seldom repeat
+    return _HumanizedIntSeconds(inp_secs)  # type: ignore
   if inp_secs == 0:
     return '0 secs'
   inp_secs = float(inp_secs)
   if inp_secs < 0.0:
     raise Error(f'Input should be >=0 and got {inp_secs}')
   if inp_secs < 0.01:
-    return f'{inp_secs * 1000.0:0.3f} msecs'  # cspell:disable-line
-  if inp_secs < 1.0:
-    return f'{inp_secs:0.4f} secs'
-  if inp_secs < 60.0:
-    return f'{inp_secs:0.2f} secs'
-  if inp_secs < 60.0 * 60.0:
-    return f'{(inp_secs / 60.0):0.2f} mins'
-  if inp_secs < 24.0 * 60.0 * 60.0:
-    return f'{(inp_secs / (60.0 * 60.0)):0.2f} hours'
-  return f'{(inp_secs / (24.0 * 60.0 * 60.0)):0.2f} days'
+    return _FMT_MSECS(inp_secs * 1000.0)
+  formatter, divisor = _SECONDS_UNITS[bisect.bisect_right(_SECONDS_THRESHOLDS, inp_secs)]
+  return formatter(inp_secs / divisor)
+
+
+@functools.lru_cache(maxsize=_HUMANIZED_CACHE_ENTRIES)
+def _HumanizedIntSeconds(inp_secs: int) -> str:
+  """HumanizedSeconds() for int values, cached."""
+  return HumanizedSeconds(float(inp_secs))
+
+
+def _RoundScaled(values: Any, decimals: int) -> tuple[Any, Any]:
+  """Round `values * 10**decimals` exactly like '%.{decimals}f' does (half-even, on exact values).
+
+  Simply rounding the float product would sometimes be wrong, as the product itself is rounded.
+  So we get the exact product as `hi + lo` (Dekker's algorithm) and use `lo` to break the ties.
+
+  Args:
+    values: numpy float64 array
+    decimals: number of decimal places
+
+  Returns:
+    (rounded values as int64 array, mask of values that could not be exactly rounded)
+  """
+  scale = float(10 ** decimals)
+  with np.errstate(invalid='ignore', over='ignore'):  # nan/inf/huge values are discarded below
+    hi = values * scale
+    split = 134217729.0 * values  # 2**27 + 1
+    v_hi = split - (split - values)
+    v_lo = values - v_hi
+    split = 134217729.0 * scale
+    s_hi = split - (split - scale)
+    s_lo = scale - s_hi
+    lo = ((v_hi * s_hi - hi) + v_hi * s_lo + v_lo * s_hi) + v_lo * s_lo
+  inexact = ~(np.abs(hi) < _ARRAY_EXACT_LIMIT)  # also catches nan/inf
+  hi[inexact] = 0.0
+  rounded = np.rint(hi)
+  diff = hi - rounded  # exact: |diff| <= 0.5, and if it is 0.5 it is a tie only if lo == 0
+  rounded += ((diff == 0.5) & (lo > 0.0)).astype(np.float64) - ((diff == -0.5) & (lo < 0.0))
+  return (rounded.astype(np.int64), inexact)
+
+
+def _FixedPointStrings(scaled: Any, decimals: int, suffix: str) -> Any:
+  """Format int64 array `scaled` as fixed point numbers with `decimals` places, plus `suffix`."""
+  int_part, frac_part = np.divmod(scaled, 10 ** decimals) if decimals else (scaled, None)
+  n_int: int = len(str(int(int_part.max())))
+  if int_part.max() < 2 ** 32:  # much faster divisions
+    int_part = int_part.astype(np.uint32)
+    frac_part = None if frac_part is None else frac_part.astype(np.uint32)
+  # write the digits as UCS4 codes, right aligned, so we can view the result as a str array
+  width: int = n_int + (decimals + 1 if decimals else 0) + len(suffix)
+  out = np.empty((scaled.size, width), dtype=np.uint32)
+  value = int_part.copy()
+  for col in range(n_int - 1, -1, -1):
+    out[:, col] = value % 10 + 48  # 48 is ord('0')
+    value //= 10
+  for col in range(n_int - 1):  # blank the leading zeros
+    out[:, col][int_part < 10 ** (n_int - 1 - col)] = 32  # 32 is ord(' ')
+  if frac_part is not None:
+    out[:, n_int] = 46  # 46 is ord('.')
+    for col in range(n_int + decimals, n_int, -1):
+      out[:, col] = frac_part % 10 + 48
+      frac_part //= 10
+  out[:, width - len(suffix):] = np.array([ord(c) for c in suffix], dtype=np.uint32)
+  strings = out.view(f'U{width}').ravel()
+  return np.char.lstrip(strings) if n_int > 1 else strings
+
+
+def _HumanizedArray(
+    values: Any, units: _ArrayUnits, unit_index: Any,
+    scalar_method: Callable[[Any], str]) -> Any:
+  """Vectorized Humanized*() for flat array `values`, given the unit index of each value."""
+  groups: list[tuple[Any, Any]] = []  # (mask, strings)
+  for i, (factor, multiply, decimals, suffix) in enumerate(units):
+    mask = unit_index == i
+    if not mask.any():
+      continue
+    unit_values = values[mask]
+    if factor is None:
+      groups.append((mask, _FixedPointStrings(unit_values.astype(np.int64), 0, suffix)))
+      continue
+    unit_values = unit_values * factor if multiply else unit_values / factor
+    scaled, inexact = _RoundScaled(unit_values, decimals)
+    if inexact.any():  # rare: huge numbers (or nan/inf) go the slow way
+      mask_inexact = mask.copy()
+      mask_inexact[mask] = inexact
+      groups.append(
+          (mask_inexact, np.array([scalar_method(v) for v in values[mask_inexact].tolist()])))
+      mask[mask] = ~inexact
+      scaled = scaled[~inexact]
+      if not scaled.size:
+        continue
+    groups.append((mask, _FixedPointStrings(scaled, decimals, suffix)))
+  result = np.empty(values.size, dtype=max(
+      (strings.dtype for _, strings in groups), key=lambda d: d.itemsize, default=np.str_))
+  for mask, strings in groups:
+    result[mask] = strings
+  return result
+
+
+def HumanizedBytesArray(sizes: Any) -> Any:
+  """Vectorized HumanizedBytes(), for large arrays. Needs `numpy`.
+
+  There is a fixed cost of about 60 microseconds per call, so below about 100 values a plain loop
+  over HumanizedBytes() is faster; see run_benchmarks.py for the crossover on your machine.
+
+  Args:
+    sizes: numpy array (or sequence) of integer byte lengths
+
+  Returns:
+    numpy array of str, same shape as `sizes`, with exactly the same strings as HumanizedBytes()
+
+  Raises:
+    Error: negative size, or numpy is not installed
+  """
+  if np is None:
+    raise Error('HumanizedBytesArray() needs the `numpy` module: pip install numpy')
+  sizes = np.asarray(sizes)
+  values = sizes.ravel()
+  if not values.size:
+    return np.empty(sizes.shape, dtype=np.str_)
+  if values.min() < 0:
+    raise Error(f'Input should be >=0 and got {values.min()}')
+  if values.dtype.kind not in 'iu' or values.max() >= 2 ** 53:  # float, or not exact as float
+    return np.array([HumanizedBytes(v) for v in values.tolist()]).reshape(sizes.shape)
+  return _HumanizedArray(
+      values, _BYTE_ARRAY_UNITS, np.searchsorted(_BYTE_THRESHOLDS, values, side='right'),
+      HumanizedBytes).reshape(sizes.shape)
+
+
+def HumanizedDecimalArray(sizes: Any) -> Any:
+  """Vectorized HumanizedDecimal(), for large arrays. Needs `numpy`.
+
+  Args:
+    sizes: numpy array (or sequence) of integer sizes
+
+  Returns:
+    numpy array of str, same shape as `sizes`, with exactly the same strings as HumanizedDecimal()
+
+  Raises:
+    Error: negative size, or numpy is not installed
+  """
+  if np is None:
+    raise Error('HumanizedDecimalArray() needs the `numpy` module: pip install numpy')
+  sizes = np.asarray(sizes)
+  values = sizes.ravel()
+  if not values.size:
+    return np.empty(sizes.shape, dtype=np.str_)
+  if values.min() < 0:
+    raise Error(f'Input should be >=0 and got {values.min()}')
+  if values.dtype.kind not in 'iu' or values.max() >= 2 ** 53:  # float, or not exact as float
+    return np.array([HumanizedDecimal(v) for v in values.tolist()]).reshape(sizes.shape)
+  return _HumanizedArray(
+      values, _DECIMAL_ARRAY_UNITS, np.searchsorted(_DECIMAL_THRESHOLDS, values, side='right'),
+      HumanizedDecimal).reshape(sizes.shape)
+
+
+def HumanizedSecondsArray(times: Any) -> Any:
+  """Vectorized HumanizedSeconds(), for large arrays. Needs `numpy`.
+
+  Args:
+    times: numpy array (or sequence) of amounts of time, in seconds, int or float
+
+  Returns:
+    numpy array of str, same shape as `times`, with exactly the same strings as HumanizedSeconds()
+
+  Raises:
+    Error: negative value, or numpy is not installed
+  """
+  if np is None:
+    raise Error('HumanizedSecondsArray() needs the `numpy` module: pip install numpy')
+  times = np.asarray(times)
+  values = times.ravel().astype(np.float64)
+  if not values.size:
+    return np.empty(times.shape, dtype=np.str_)
+  if values.min() < 0.0:
+    raise Error(f'Input should be >=0 and got {values.min()}')
+  unit_index = np.where(
+      values < 0.01, 0, np.searchsorted(_SECONDS_THRESHOLDS, values, side='right') + 1)
+  result = _HumanizedArray(values, _SECONDS_ARRAY_UNITS, unit_index, HumanizedSeconds)
+  zeros = values == 0.0
+  if zeros.any():
+    result = result.astype(f'U{max(result.itemsize // 4, 6)}')
+    result[zeros] = '0 secs'
+  return result.reshape(times.shape)
 
 
 class Timer:
@@ -267,6 +739,8 @@ class Timer:
   See also the Timed() decorator below.
   """
 
+  __slots__ = ('_start_ns', '_end_ns', '_log')  # small and fast: many Timer objects are created
+
   def __init__(self, log: Optional[str] = None):
     """Construct.
 
@@ -274,20 +748,27 @@ class Timer:
       log: (default None) If given as string will logging.info a log upon __exit__
           like '%s: %s' % (log, execution_time)
     """
-    self._start: Optional[float] = None
-    self._end: Optional[float] = None
+    self._start_ns: Optional[int] = None  # from an arbitrary (but fixed) reference
+    self._end_ns: Optional[int] = None    # from an arbitrary (but fixed) reference
     self._log: Optional[str] = log
 
   def __enter__(self) -> Any:
     """Enter Timed context. Starts the timer."""
-    self._start = time.time()
+    self._start_ns = _PERF_COUNTER_NS()
     return self
 
   def __exit__(self, exc_type: Any, exc_val: Any, exc_tb: Any) -> Literal[False]:
     """Exit Timed context. Will stop the timer and will log if necessary."""
-    _: str = self.partial
+    self._end_ns = _PERF_COUNTER_NS()
+    if self._log is not None:
+      self._Log(None)
     return False  # do not stop exceptions from propagating!
 
+  def _Log(self, readable: Optional[str]) -> None:
+    """Log the time, but only pay for formatting it (if not given) if it will really be logged."""
+    if _ROOT_LOGGER.isEnabledFor(logging.INFO):
+      logging.info('%s: %s', self._log, self.readable if readable is None else readable)
+
   @property
   def delta(self) -> float:
     """The time, in seconds. Cannot be called before some end is stored.
@@ -298,9 +779,9 @@ class Timer:
     Raises:
       Error: chronometer is not set yet
     """
-    if not self._start or not self._end:
+    if self._start_ns is None or self._end_ns is None:
       raise Error('Cannot get time from this chronometer yet.')
-    return self._end - self._start
+    return (self._end_ns - self._start_ns) / 1e9
 
   @property
   def readable(self) -> str:
@@ -310,10 +791,10 @@ class Timer:
   @property
   def partial(self) -> str:
     """Stores an end time (and will log if necessary)."""
-    self._end = time.time()
+    self._end_ns = _PERF_COUNTER_NS()
     readable: str = self.readable
     if self._log is not None:
-      logging.info('%s: %s', self._log, readable)
+      self._Log(readable)
     return readable
 
 
@@ -327,9 +808,10 @@ def Timed(log: Optional[str] = None) -> Callable[[Callable[[Any], Any]], Callabl
 
   def _Timed(func: Callable[[Any], Any]) -> Callable[[Any], Any]:
 
+    log_message: str = f'{(func.__name__ + "()") if log is None else log!r} execution time'
+
     @functools.wraps(func)
     def _WrappedCall(*args: list[Any], **kwargs: dict[Any, Any]) -> Any:
-      log_message: str = f'{(func.__name__ + "()") if log is None else log!r} execution time'
       with Timer(log=log_message):
         return func(*args, **kwargs)
 
@@ -354,6 +836,10 @@ def DeriveKeyFromStaticPassword(str_password: str) -> bytes:
   ON THE OTHER HAND, this only serves the purpose of generating keys from static passwords.
   NEVER use this method to save a database of keys. ONLY use it for direct user input.
 
+  The last few derived keys are cached in memory, so repeated calls with the same password in the
+  same process are cheap. The cache is indexed by a keyed hash of the password (with a random
+  per-process secret), never by the password itself. Call ClearKeyCache() to drop it.
+
   Docs: https://cryptography.io/en/latest/
 
   Args:
@@ -367,23 +853,115 @@ def DeriveKeyFromStaticPassword(str_password: str) -> bytes:
   """
   if not str_password or not str_password.strip():
     raise Error('Empty passwords not allowed, for safety reasons')
-  kdf = hazmat_pbkdf2.PBKDF2HMAC(
-      algorithm=hazmat_hashes.SHA256(),
-      length=32,
-      salt=b'\xda4,92\x80\x88\xf1\xc8\x18x@Q\x95*&',  # fixed salt: do NOT ever change!
-      iterations=1745202)                             # fixed iterations: do NOT ever change!
-  crypto_key: bytes = kdf.derive(str_password.encode('utf-8'))
-  return base64.urlsafe_b64encode(crypto_key)
+  password: bytes = str_password.encode('utf-8')
+  # look in the cache, which is LRU
+  cache_key: bytes = hashlib.blake2b(
+      password, digest_size=16, key=_DERIVED_KEY_CACHE_SECRET).digest()
+  with _DERIVED_KEY_CACHE_LOCK:
+    crypto_key: Optional[bytes] = _DERIVED_KEY_CACHE.get(cache_key)
+    if crypto_key is not None:
+      _DERIVED_KEY_CACHE.move_to_end(cache_key)
+      return crypto_key
+  # not cached: derive and store
+  crypto_key = base64.urlsafe_b64encode(hashlib.pbkdf2_hmac(
+      'sha256', password, _PASSWORD_SALT, _PASSWORD_ITERATIONS, dklen=32))
+  with _DERIVED_KEY_CACHE_LOCK:
+    _DERIVED_KEY_CACHE[cache_key] = crypto_key
+    if len(_DERIVED_KEY_CACHE) > _DERIVED_KEY_CACHE_ENTRIES:
+      _DERIVED_KEY_CACHE.popitem(last=False)
+  return crypto_key
+
+
+@functools.lru_cache(maxsize=_FERNET_CACHE_ENTRIES)
+def _Fernet(key: bytes) -> bin_fernet.BinaryFernet:
+  """Fernet object for key, memoized so repeated calls with the same key skip the key setup."""
+  return bin_fernet.BinaryFernet(key)
+
+
+def ClearKeyCache() -> None:
+  """Drop all cached key material. For security-sensitive callers, like after a session ends."""
+  with _DERIVED_KEY_CACHE_LOCK:
+    _DERIVED_KEY_CACHE.clear()
+  _Fernet.cache_clear()
+  _AESGCMKey.cache_clear()
 
 
 def Encrypt(plaintext: bytes, key: bytes) -> bytes:
-  """Encryption wrapper."""
-  return bin_fernet.BinaryFernet(key).encrypt(plaintext)
+  """Encryption wrapper. The key setup is cached, see ClearKeyCache()."""
+  return _Fernet(key).encrypt(plaintext)
 
 
 def Decrypt(ciphertext: bytes, key: bytes) -> bytes:
-  """Decryption wrapper."""
-  return bin_fernet.BinaryFernet(key).decrypt(ciphertext)
+  """Decryption wrapper. The key setup is cached, see ClearKeyCache()."""
+  return _Fernet(key).decrypt(ciphertext)
+
+
+@functools.lru_cache(maxsize=_FERNET_CACHE_ENTRIES)
+def _AESGCMKey(key: bytes) -> bytes:
+  """AES-256 key for a Fernet-style key (URL-safe base64-encoded 32-byte key), memoized.
+
+  The same key is also used for Fernet (as its HMAC and AES-CBC keys), so AES-GCM gets its own
+  subkey, derived with HKDF-SHA256: one secret never keys two different constructions directly.
+  """
+  try:
+    key256: bytes = base64.urlsafe_b64decode(key)
+  except binascii.Error as err:
+    raise ValueError('Key must be 32 url-safe base64-encoded bytes') from err
+  if len(key256) != 32:
+    raise ValueError('Key must be 32 url-safe base64-encoded bytes')
+  return hkdf.HKDF(
+      algorithm=hashes.SHA256(), length=32, salt=None, info=_AES_GCM_KEY_INFO).derive(key256)
+
+
+class _AESGCMWriter:
+  """A minimal write-only binary file object that AES-256-GCM encrypts everything written to it.
+
+  AES-256-GCM is one AES-NI + carry-less multiply pass, instead of Fernet's two. Output (given to
+  `sink` as it is produced) is: _AES_GCM_TAG + 96 bit nonce + ciphertext + 128 bit authentication
+  tag. This can be chained after a _CompressingWriter (or be the `pickle.dump()` target) and the
+  plaintext is never materialized in memory.
+  """
+
+  def __init__(self, key: bytes, sink: Callable[[bytes], Any]) -> None:
+    """Construct.
+
+    Args:
+      key: URL-safe base64-encoded 32-byte key (same format as Fernet keys)
+      sink: callable that will receive the encrypted data, in order
+    """
+    self.size: int = 0  # plaintext bytes written so far
+    self._sink: Callable[[bytes], Any] = sink
+    nonce: bytes = os.urandom(12)
+    self._encoder: ciphers.CipherContext = ciphers.Cipher(  # cspell:disable-line
+        algorithms.AES256(_AESGCMKey(key)), modes.GCM(nonce)).encryptor()
+    sink(_AES_GCM_TAG + nonce)
+
+  def write(self, data: bytes) -> int:
+    """Encrypt data."""
+    n_bytes: int = memoryview(data).nbytes
+    self.size += n_bytes
+    self._sink(self._encoder.update(data))
+    return n_bytes
+
+  def close(self) -> None:
+    """Finish encryption, giving the remaining data and the authentication tag to the sink."""
+    self._sink(self._encoder.finalize() + self._encoder.tag)  # type: ignore
+
+
+def _DecryptAESGCM(ciphertext: bytes, key: bytes) -> bytes:
+  """AES-256-GCM decryption of data from _AESGCMWriter.
+
+  Raises:
+    bin_fernet.InvalidToken: invalid or tampered ciphertext, or wrong key (same as Decrypt())
+  """
+  if len(ciphertext) < 29 or not ciphertext.startswith(_AES_GCM_TAG):
+    raise bin_fernet.InvalidToken()
+  decoder: ciphers.CipherContext = ciphers.Cipher(  # cspell:disable-line
+      algorithms.AES256(_AESGCMKey(key)), modes.GCM(ciphertext[1:13], ciphertext[-16:])).decryptor()
+  try:
+    return decoder.update(memoryview(ciphertext)[13:-16]) + decoder.finalize()  # (no copy)
+  except exceptions.InvalidTag as err:
+    raise bin_fernet.InvalidToken() from err
 
 
 class BlockEncoder256:
@@ -391,6 +969,7 @@ class BlockEncoder256:
 
   Please DO **NOT** use this for regular cryptography. For regular crypto use Encrypt()/Decrypt().
   This class was specifically built to encode/decode SHA-256 hashes using a pre-existing key.
+  Instances keep their cipher contexts open between calls, so they are NOT thread-safe.
 
   Docs: https://cryptography.io/en/latest/
   """
@@ -406,21 +985,23 @@ class BlockEncoder256:
     """
     if len(key256) != 32:
       raise Error(f'Key must be 256 bits (32 bytes) long, got {len(key256)}')
-    self._cipher = ciphers.Cipher(algorithms.AES256(key256), modes.ECB())  # nosec
+    cipher = ciphers.Cipher(algorithms.AES256(key256), modes.ECB())  # nosec
+    # ECB keeps no state between blocks and our inputs are always whole blocks, so we can
+    # create the contexts (and the key schedule) only once and never finalize() them
+    self._encoder: ciphers.CipherContext = cipher.encryptor()  # cspell:disable-line
+    self._decoder: ciphers.CipherContext = cipher.decryptor()  # cspell:disable-line
 
   def EncryptBlock256(self, plaintext256: bytes) -> bytes:
     """Encrypt a 256 bits block."""
     if len(plaintext256) != 32:
       raise Error(f'Plaintext must be 256 bits (32 bytes) long, got {len(plaintext256)}')
-    encoder: ciphers.CipherContext = self._cipher.encryptor()  # cspell:disable-line
-    return encoder.update(plaintext256) + encoder.finalize()
+    return self._encoder.update(plaintext256)
 
   def DecryptBlock256(self, ciphertext256: bytes) -> bytes:
     """Decrypt a 256 bits block."""
     if len(ciphertext256) != 32:
       raise Error(f'Ciphertext must be 256 bits (32 bytes) long, got {len(ciphertext256)}')
-    encoder: ciphers.CipherContext = self._cipher.decryptor()  # cspell:disable-line
-    return encoder.update(ciphertext256) + encoder.finalize()
+    return self._decoder.update(ciphertext256)
 
   def EncryptHexdigest256(self, plaintext_hexdigest: str) -> str:
     """Encrypt a 256 bits hexadecimal block, outputting also a 256 bits hexadecimal."""
@@ -430,47 +1011,672 @@ class BlockEncoder256:
     """Decrypt a 256 bits hexadecimal block, outputting also a 256 bits hexadecimal."""
     return self.DecryptBlock256(bytes.fromhex(ciphertext_hexdigest)).hex()
 
+  def EncryptBlocks256(self, plaintexts256: list[bytes]) -> list[bytes]:
+    """Encrypt many 256 bits blocks in a single cipher call.
+
+    For speed, only the total length is checked: callers must guarantee every block is
+    exactly 256 bits (32 bytes) long.
+
+    Args:
+      plaintexts256: list of 256 bits blocks
+
+    Returns:
+      list of encrypted 256 bits blocks, in the same order
+
+    Raises:
+      Error: total length is not a multiple of 256 bits
+    """
+    return _SplitBlocks256(self._encoder.update(_CheckBlocks256(b''.join(plaintexts256))))
+
+  def DecryptBlocks256(self, ciphertexts256: list[bytes]) -> list[bytes]:
+    """Decrypt many 256 bits blocks in a single cipher call. Same caveats as EncryptBlocks256()."""
+    return _SplitBlocks256(self._decoder.update(_CheckBlocks256(b''.join(ciphertexts256))))
+
+  def EncryptHexdigests256(self, plaintext_hexdigests: list[str]) -> list[str]:
+    """Encrypt many 256 bits hexadecimal blocks. Same caveats as EncryptBlocks256()."""
+    return _SplitHexdigests256(
+        self._encoder.update(_CheckBlocks256(bytes.fromhex(''.join(plaintext_hexdigests)))))
+
+  def DecryptHexdigests256(self, ciphertext_hexdigests: list[str]) -> list[str]:
+    """Decrypt many 256 bits hexadecimal blocks. Same caveats as EncryptBlocks256()."""
+    return _SplitHexdigests256(
+        self._decoder.update(_CheckBlocks256(bytes.fromhex(''.join(ciphertext_hexdigests)))))
+
+
+def _CheckBlocks256(data: bytes) -> bytes:
+  """Check a buffer of concatenated 256 bits blocks has a valid total length; returns data."""
+  if len(data) % 32:
+    raise Error(f'Blocks must be 256 bits (32 bytes) long, got {len(data)} bytes total')
+  return data
+
+
+def _SplitBlocks256(data: bytes) -> list[bytes]:
+  """Split a buffer into 256 bits blocks."""
+  return [data[i:i + 32] for i in range(0, len(data), 32)]
+
+
+def _SplitHexdigests256(data: bytes) -> list[str]:
+  """Split a buffer into 256 bits hexadecimal blocks."""
+  hex_data: str = data.hex()
+  return [hex_data[i:i + 64] for i in range(0, len(hex_data), 64)]
+
+
+def _CompressionCodec(
+    compress: Union[bool, CompressionCodec], level: Optional[int] = None) -> CompressionCodec:
+  """Normalize a `compress` argument into a codec name, and check `level` is valid for that codec.
+
+  Args:
+    compress: True (default codec: 'zstd' if available, else 'bz2'), False ('none'),
+        or a CompressionCodec name
+    level: (default None) compression level, to check against the codec; None is always valid
+
+  Returns:
+    codec name
+
+  Raises:
+    Error: unknown codec, codec module not installed, or invalid level for the codec
+  """
+  if compress is True:
+    codec: CompressionCodec = 'bz2' if zstandard is None else 'zstd'
+  elif compress is False:
+    codec = 'none'
+  elif compress not in ('none', 'bz2', 'zstd', 'lz4'):
+    raise Error(f'Unknown compression codec {compress!r}')
+  elif (compress == 'zstd' and zstandard is None) or (compress == 'lz4' and lz4_frame is None):
+    raise Error(
+        f'Compression codec {compress!r} needs the `{_CODEC_MODULES[compress]}` module: '
+        f'pip install {_CODEC_MODULES[compress]}')
+  else:
+    codec = compress
+  if level is not None and codec != 'none':
+    min_level, max_level = _CODEC_LEVELS[codec]
+    if not min_level <= level <= max_level:
+      raise Error(
+          f'Compression level {level} is invalid for {codec!r} ({min_level} to {max_level})' +
+          (f'; compress=True picked {codec!r}, as `zstandard` is not installed: give '
+           'the codec explicitly' if compress is True and codec == 'bz2' else ''))
+  return codec
+
+
+def _CompressionPool() -> concurrent.futures.ThreadPoolExecutor:
+  """The (lazily created) shared thread pool for parallel compression."""
+  global _COMPRESSION_POOL  # pylint: disable=global-statement
+  if _COMPRESSION_POOL is None:
+    _COMPRESSION_POOL = concurrent.futures.ThreadPoolExecutor(
+        max_workers=os.cpu_count(), thread_name_prefix='compression')
+  return _COMPRESSION_POOL
+
+
+def _ResetAfterFork() -> None:
+  """In a forked child: drop the parent's compression thread pool.
+
+  Its threads did not survive the fork, so anything submitted to it would wait forever. It is
+  not shut down (its locks may be in any state): just forgotten, and a new one will be created.
+  Same for the idle zstd compressors, as some have their own worker threads.
+  """
+  global _COMPRESSION_POOL  # pylint: disable=global-statement
+  _COMPRESSION_POOL = None
+  _ZSTD_IDLE_COMPRESSORS.clear()  # the multi-threaded ones have the same problem
+
+
+if hasattr(os, 'register_at_fork'):  # not on Windows, which has no fork() anyway
+  os.register_at_fork(after_in_child=_ResetAfterFork)
+
+
+class _ParallelBZ2Compressor:
+  """Drop-in replacement for bz2.BZ2Compressor that compresses blocks in parallel threads.
+
+  Input is cut in independent blocks, each compressed into its own bz2 stream. The output is a
+  valid multi-stream bz2 file, that bz2.decompress() and bz2.BZ2File read transparently. The bz2
+  module releases the GIL while compressing, so threads run in parallel.
+  """
+
+  def __init__(self, level: int = _BZ2_LEVEL) -> None:
+    """Construct.
+
+    Args:
+      level: (default 9) bz2 compression level, 1 to 9
+    """
+    self._level: int = level
+    self._buffer = bytearray()
+    self._pending: collections.deque[concurrent.futures.Future[bytes]] = collections.deque()
+    self._max_pending: int = 2 * (os.cpu_count() or 1)  # bounds memory use
+
+  def compress(self, data: bytes) -> bytes:
+    """Add data; returns any compressed blocks that are ready (in order), possibly b''.
+
+    A single large write (pickle protocol 5 hands over big buffers in one call) is cut into blocks
+    straight from `data`, and we wait on the oldest blocks as we go, so no more than _max_pending
+    blocks are ever copied and queued: memory use does not grow with the size of `data`.
+    """
+    view = memoryview(data).cast('B')
+    blocks: list[bytes] = []
+    offset: int = 0
+    if self._buffer:  # complete the partial block from previous writes first
+      offset = min(len(view), _BZ2_BLOCK_SIZE - len(self._buffer))
+      self._buffer += view[:offset]
+      if len(self._buffer) == _BZ2_BLOCK_SIZE:
+        self._Submit(bytes(self._buffer))
+        self._buffer.clear()
+        blocks.append(self._Collect(self._max_pending))
+    while len(view) - offset >= _BZ2_BLOCK_SIZE:
+      self._Submit(bytes(view[offset:offset + _BZ2_BLOCK_SIZE]))
+      offset += _BZ2_BLOCK_SIZE
+      blocks.append(self._Collect(self._max_pending))
+    self._buffer += view[offset:]
+    blocks.append(self._Collect(self._max_pending))
+    return b''.join(blocks)
+
+  def flush(self) -> bytes:
+    """Finish compression; returns all the remaining compressed data."""
+    if not self._pending:
+      return bz2.compress(self._buffer, self._level)  # small data: no need for threads
+    if self._buffer:
+      self._Submit(bytes(self._buffer))
+    return self._Collect(0)
+
+  def _Submit(self, block: bytes) -> None:
+    """Queue one block for compression in the thread pool."""
+    self._pending.append(_CompressionPool().submit(bz2.compress, block, self._level))
+
+  def _Collect(self, max_pending: int) -> bytes:
+    """Pop compressed blocks in order: all that are done, and wait until only max_pending remain."""
+    blocks: list[bytes] = []
+    while self._pending and (len(self._pending) > max_pending or self._pending[0].done()):
+      blocks.append(self._pending.popleft().result())
+    return b''.join(blocks)
+
+
+class _ZstdCompressor:
+  """zstd compressor object (like zstandard's compressobj()) that is cheap for small data.
+
+  Building a zstandard.ZstdCompressor costs many times more than compressing a small pickle (and
+  more so with worker threads), so they are kept for reuse, per level. Data is buffered up to
+  _ZSTD_THREADS_MIN_SIZE: small data is compressed in one go, without threads, and only larger
+  data gets a multi-threaded streaming compressor.
+  """
+
+  def __init__(self, level: int) -> None:
+    """Construct.
+
+    Args:
+      level: zstd compression level
+    """
+    self._level: int = level
+    self._buffer = bytearray()
+    self._threaded: Any = None  # multi-threaded zstandard.ZstdCompressor, once data is large
+    self._stream: Any = None  # its compressobj()
+
+  def compress(self, data: bytes) -> bytes:
+    """Add data; returns any compressed data that is ready, possibly b''."""
+    if self._stream is not None:
+      return self._stream.compress(data)
+    if len(self._buffer) + memoryview(data).nbytes < _ZSTD_THREADS_MIN_SIZE:
+      self._buffer += data
+      return b''
+    # large data: go multi-threaded, starting with what was buffered
+    self._threaded = self._Get(True)
+    self._stream = self._threaded.compressobj()
+    compressed: bytes = self._stream.compress(self._buffer) if self._buffer else b''
+    self._buffer = bytearray()
+    return compressed + self._stream.compress(data)
+
+  def flush(self) -> bytes:
+    """Finish compression; returns all the remaining compressed data."""
+    if self._stream is None:  # small data: all in one go
+      compressor: Any = self._Get(False)
+      compressed: bytes = compressor.compress(self._buffer)
+      self._Put(False, compressor)
+      return compressed
+    compressed = self._stream.flush()
+    self._Put(True, self._threaded)
+    return compressed
+
+  def _Get(self, threaded: bool) -> Any:
+    """An idle zstandard.ZstdCompressor for our level, or a new one."""
+    idle: Optional[list[Any]] = _ZSTD_IDLE_COMPRESSORS.get((self._level, threaded))
+    try:
+      return idle.pop()  # type: ignore  # atomic, so safe with concurrent callers
+    except (AttributeError, IndexError):
+      return zstandard.ZstdCompressor(
+          level=self._level, threads=-1 if threaded else 0, write_checksum=True)
+
+  def _Put(self, threaded: bool, compressor: Any) -> None:
+    """Give back a compressor for reuse; only done after a successful flush()."""
+    idle: list[Any] = _ZSTD_IDLE_COMPRESSORS.setdefault((self._level, threaded), [])
+    if len(idle) < _ZSTD_IDLE_MAX:
+      idle.append(compressor)
+
+
+class _CompressingWriter:
+  """A minimal write-only binary file object that compresses everything written to it.
+
+  Used as the `pickle.dump()` target, so the pickle stream goes straight into the compressor
+  (in pickle's ~64kb frames) and the full uncompressed pickle is never materialized in memory.
+  """
+
+  def __init__(
+      self, codec: CompressionCodec, sink: Callable[[bytes], Any],
+      level: Optional[int] = None) -> None:
+    """Construct.
+
+    Args:
+      codec: compression codec to use (already normalized, and not 'none')
+      sink: callable that will receive the compressed data, in order
+      level: (default None) compression level; None means the codec default
+    """
+    self.size: int = 0  # uncompressed bytes written so far
+    self._sink: Callable[[bytes], Any] = sink
+    self._compressor: Any
+    if codec == 'bz2':
+      self._compressor = _ParallelBZ2Compressor(_BZ2_LEVEL if level is None else level)
+    elif codec == 'zstd':
+      self._compressor = _ZstdCompressor(_ZSTD_LEVEL if level is None else level)
+    else:
+      self._compressor = lz4_frame.LZ4FrameCompressor(
+          compression_level=_LZ4_LEVEL if level is None else level, content_checksum=True)
+      sink(self._compressor.begin())  # frame header
+
+  def write(self, data: bytes) -> int:
+    """Compress data. Will be called by pickle."""
+    n_bytes: int = memoryview(data).nbytes
+    self.size += n_bytes
+    compressed: bytes = self._compressor.compress(data)
+    if compressed:
+      self._sink(compressed)
+    return n_bytes
+
+  def close(self) -> None:
+    """Flush the compressor, giving all the remaining compressed data to the sink."""
+    self._sink(self._compressor.flush())
+
+
+class _CountingWriter:
+  """A minimal write-only binary file object that only counts the bytes it passes on to `sink`."""
+
+  def __init__(self, sink: Callable[[bytes], Any]) -> None:
+    """Construct.
+
+    Args:
+      sink: callable that will receive the data, in order
+    """
+    self.size: int = 0  # bytes written so far
+    self._sink: Callable[[bytes], Any] = sink
+
+  def write(self, data: bytes) -> int:
+    """Pass data on to the sink."""
+    n_bytes: int = memoryview(data).nbytes
+    self.size += n_bytes
+    self._sink(data)
+    return n_bytes
+
+
+def _SerializeTo(
+    obj: Any, sink: Callable[[bytes], Any], codec: CompressionCodec,
+    key: Optional[bytes], level: Optional[int]) -> tuple[int, int, int]:
+  """Pickle, compress and AES-GCM encrypt (as needed) an object, in a single pass.
+
+  Pickle writes into a chain of [compressor ->] [AES-GCM encryptor ->] `sink`, so no
+  intermediate BLOB is ever built.
+
+  Args:
+    obj: Any serializable Python object
+    sink: callable that will receive the output data, in order
+    codec: compression codec to use (already normalized)
+    key: if given, AES-GCM key to use (URL-safe base64-encoded 32-byte key)
+    level: compression level; None means the codec default
+
+  Returns:
+    (pickle size, compressed size, output size)
+  """
+  output = _CountingWriter(sink)
+  encryptor: Optional[_AESGCMWriter] = None if key is None else _AESGCMWriter(key, output.write)
+  stored: Union[_CountingWriter, _AESGCMWriter] = output if encryptor is None else encryptor
+  compressor: Optional[_CompressingWriter] = (
+      None if codec == 'none' else _CompressingWriter(codec, stored.write, level))
+  writer: Union[_CountingWriter, _AESGCMWriter, _CompressingWriter] = compressor or stored
+  pickle.dump(obj, writer, protocol=_PICKLE_PROTOCOL)  # type: ignore
+  if compressor is not None:
+    compressor.close()
+  if encryptor is not None:
+    encryptor.close()
+  return (writer.size, stored.size, output.size)
+
+
+@contextlib.contextmanager
+def _PausedGC() -> Iterator[None]:
+  """Context with the cyclic garbage collector paused, to be used around unpickling.
+
+  Unpickling a large object graph allocates many container objects and nothing is garbage yet,
+  so the collector would just run many useless (and ever slower) passes over the new objects.
+  """
+  was_enabled: bool = gc.isenabled()
+  gc.disable()
+  try:
+    yield
+  finally:
+    if was_enabled:
+      gc.enable()
+
+
+@contextlib.contextmanager
+def _DeserializationErrors() -> Iterator[None]:
+  """Context that turns errors from bad data (_DATA_ERRORS) into an Error (with the cause).
+
+  Other exceptions, like ImportError/AttributeError for a class that is gone or a MemoryError,
+  can also happen with perfectly good data, so they go through unchanged. (For compressed data
+  _PickleLoadAll() checks the stream first, so corruption is still reported as an Error.)
+  """
+  try:
+    yield
+  except _DATA_ERRORS as err:
+    raise Error(f'Corrupt or invalid serialized data: {err!r}') from err
+
+
+def _DecompressBZ2Stream(stream: memoryview) -> Optional[bytes]:
+  """Decompress exactly one bz2 stream; None if `stream` is not exactly one valid bz2 stream."""
+  decompressor = bz2.BZ2Decompressor()
+  try:
+    data: bytes = decompressor.decompress(stream)
+  except (OSError, EOFError):
+    return None
+  return data if decompressor.eof and not decompressor.unused_data else None
+
+
+class _ParallelBZ2Reader(io.RawIOBase):
+  """Readable raw binary stream that decompresses multi-stream bz2 data in parallel threads.
+
+  Counterpart of _ParallelBZ2Compressor. The stream starts are found by searching for the bz2
+  headers, but those bytes could also happen by chance inside compressed data, so every stream is
+  checked to decompress to its exact end. If any check fails we fall back to sequential
+  decompression from the start of the failed stream, which is always a real stream start.
+  """
+
+  def __init__(self, data: Union[bytes, mmap.mmap], starts: list[int]) -> None:
+    """Construct.
+
+    Args:
+      data: multi-stream bz2 data; can also be a memory mapped file
+      starts: candidate offsets of the streams in `data`, in order, the first being 0
+    """
+    super().__init__()
+    self._data = memoryview(data)
+    self._bounds: list[int] = starts + [len(data)]
+    self._next: int = 0  # next stream to submit
+    self._pending: collections.deque[tuple[int, concurrent.futures.Future[Optional[bytes]]]] = (
+        collections.deque())
+    self._max_pending: int = 2 * (os.cpu_count() or 1)  # bounds memory use
+    self._block = memoryview(b'')
+    self._position: int = 0  # decompressed bytes read so far
+    self._fallback: Optional[BinaryIO] = None
+
+  def readable(self) -> bool:
+    """Stream is readable."""
+    return True
+
+  def tell(self) -> int:
+    """Number of decompressed bytes read so far."""
+    return self._position
+
+  def readinto(self, buffer: Any) -> int:  # type: ignore
+    """Read decompressed bytes into `buffer`; returns number of bytes, or 0 at the end."""
+    while True:
+      if self._fallback is not None:
+        n_bytes: int = self._fallback.readinto(buffer)  # type: ignore
+        self._position += n_bytes
+        return n_bytes
+      if self._block:
+        n_bytes = min(len(buffer), len(self._block))
+        buffer[:n_bytes] = self._block[:n_bytes]
+        self._block = self._block[n_bytes:]
+        self._position += n_bytes
+        return n_bytes
+      while self._next < len(self._bounds) - 1 and len(self._pending) < self._max_pending:
+        self._pending.append((self._bounds[self._next], _CompressionPool().submit(
+            self._DecompressStream, self._bounds[self._next], self._bounds[self._next + 1])))
+        self._next += 1
+      if not self._pending:
+        return 0
+      start, future = self._pending.popleft()
+      block: Optional[bytes] = future.result()
+      if block is None:  # not a real stream boundary: go sequential from here
+        self._CancelPending()
+        self._fallback = bz2.BZ2File(io.BytesIO(self._data[start:]))  # type: ignore
+      else:
+        self._block = memoryview(block)
+
+  def close(self) -> None:
+    """Close stream. Waits for running decompression tasks, as they are reading from the data."""
+    self._CancelPending()
+    if self._fallback is not None:
+      self._fallback.close()
+    self._block.release()
+    self._data.release()  # so a memory mapped file can be closed
+    super().close()
+
+  def _DecompressStream(self, start: int, end: int) -> Optional[bytes]:
+    """Decompress the bz2 stream in data[start:end] (runs in the thread pool)."""
+    with self._data[start:end] as stream:  # released right away: no views outlive the task
+      return _DecompressBZ2Stream(stream)
+
+  def _CancelPending(self) -> None:
+    """Cancel all pending decompression tasks, and wait for the ones that are already running."""
+    for _, future in self._pending:
+      future.cancel()
+    concurrent.futures.wait([future for _, future in self._pending])
+    self._pending.clear()
+    self._next = len(self._bounds)
+
+
+def _DecompressingReader(
+    data: Union[bytes, mmap.mmap]) -> tuple[Optional[BinaryIO], CompressionCodec]:
+  """Readable binary file object that decompresses data, detecting the codec from its magic bytes.
+
+  Used as the `pickle.load()` source, so pickle consumes the data as it is decompressed and the
+  full uncompressed pickle is never materialized in memory. The readers' tell() will give the
+  number of uncompressed bytes read so far.
+
+  Args:
+    data: compressed (or not) data; can also be a memory mapped file
+
+  Returns:
+    (reader, codec that was detected); reader is None for uncompressed data
+
+  Raises:
+    Error: data needs a codec module that is not installed
+  """
+  source: Any = data if isinstance(data, mmap.mmap) else io.BytesIO(data)  # mmap is file-like
+  if data[:len(_BZ2_MAGIC)] == _BZ2_MAGIC:
+    starts: list[int] = [m.start() for m in _BZ2_STREAM_START.finditer(data)]
+    if len(starts) > 1 and starts[0] == 0:  # (probably) multi-stream: decompress in parallel
+      return (io.BufferedReader(_ParallelBZ2Reader(data, starts)), 'bz2')  # type: ignore
+    return (bz2.BZ2File(source), 'bz2')  # type: ignore
+  if data[:len(_ZSTD_MAGIC)] == _ZSTD_MAGIC:
+    if zstandard is None:
+      raise Error('Data is \'zstd\' compressed, needs the `zstandard` module')
+    return (zstandard.ZstdDecompressor().stream_reader(source), 'zstd')
+  if data[:len(_LZ4_MAGIC)] == _LZ4_MAGIC:
+    if lz4_frame is None:
+      raise Error('Data is \'lz4\' compressed, needs the `lz4` module')
+    return (lz4_frame.LZ4FrameFile(source), 'lz4')  # type: ignore
+  return (None, 'none')  # pickles always start with b'\x80', so they never match the above
+
+
+def _PickleLoadAll(reader: BinaryIO) -> tuple[Any, int]:
+  """pickle.load() from a _DecompressingReader() reader, then read it to the end.
+
+  Pickle stops at its STOP opcode, so without the final read the codec would never reach (and
+  verify) the checksums/CRCs at the end of the compressed data, and corruption could go unnoticed.
+  Decompression is streamed into pickle, so corrupt data can also fail in pickle first, with any
+  exception (garbage opcodes can do anything); if it is not one of _DATA_ERRORS, the rest of the
+  stream is checked: if the codec finds it corrupt that is an Error, else the exception is raised.
+
+  Args:
+    reader: readable binary file object, as given by _DecompressingReader()
+
+  Returns:
+    (unpickled object, number of uncompressed bytes read)
+
+  Raises:
+    Error: corrupt data, or there is unexpected data after the pickle
+  """
+  try:
+    obj: Any = pickle.load(reader)  # nosec - this is dangerous!
+  except _DATA_ERRORS:
+    raise  # _DeserializationErrors() deals with these
+  except Exception:
+    _ReadToEnd(reader)  # corrupt data is the real problem, if that is the case
+    raise
+  serial_size: int = reader.tell()
+  if _ReadToEnd(reader):
+    raise Error('Unexpected data after the serialized object')
+  return (obj, serial_size)
+
+
+def _ReadToEnd(reader: BinaryIO) -> int:
+  """Read `reader` to the end, in blocks; returns number of bytes read.
+
+  Raises:
+    Error: the codec found the data corrupt (any exception, with it as the cause)
+  """
+  n_bytes: int = 0
+  try:
+    while block := reader.read(_BZ2_BLOCK_SIZE):
+      n_bytes += len(block)
+  except Exception as err:
+    raise Error(f'Corrupt or invalid serialized data: {err!r}') from err
+  return n_bytes
+
+
+class StructCodec:
+  """Fast fixed-layout binary codec for simple record classes with numeric fields.
+
+  For hot record types (dataclasses or NamedTuples with only int/float/bool fields) serialized
+  in large numbers, this is several times faster and much more compact than pickle: the layout is
+  resolved once, at construction, into a precompiled struct.Struct (little-endian, no padding).
+  Output can be passed on to BinSerialize() for compression/encryption, if needed. Use like:
+
+      @dataclasses.dataclass
+      class Point:
+        x: float
+        y: float
+        id: int
+
+      codec = StructCodec(Point)
+      data = codec.DumpsMany(points)  # 24 bytes per point
+      points = codec.LoadsMany(data)
+
+  The class constructor must accept the fields positionally, in declaration order.
+  """
+
+  def __init__(self, cls: type) -> None:
+    """Construct.
+
+    Args:
+      cls: record class, with type annotations for all its fields (like a dataclass/NamedTuple)
+
+    Raises:
+      Error: no fields, or unsupported field types
+    """
+    fields: dict[str, Any] = getattr(cls, '__annotations__', {})
+    if not fields:
+      raise Error(f'Class {cls.__name__} has no annotated fields')
+    bad_fields: list[str] = [n for n, t in fields.items() if t not in _STRUCT_CODES]
+    if bad_fields:
+      raise Error(f'Class {cls.__name__} fields {bad_fields!r} are not int/float/bool')
+    self._cls: type = cls
+    self._struct = struct.Struct('<' + ''.join(_STRUCT_CODES[t] for t in fields.values()))
+    self._getter: Callable[[Any], Any] = operator.attrgetter(*fields)
+    if len(fields) == 1:  # attrgetter() with a single name does not return a tuple
+      single_getter: Callable[[Any], Any] = self._getter
+      self._getter = lambda obj: (single_getter(obj),)
+
+  @property
+  def size(self) -> int:
+    """Size, in bytes, of one encoded record."""
+    return self._struct.size
+
+  def Dumps(self, obj: Any) -> bytes:
+    """Encode one record."""
+    return self._struct.pack(*self._getter(obj))
+
+  def Loads(self, data: bytes) -> Any:
+    """Decode one record."""
+    return self._cls(*self._struct.unpack(data))
+
+  def DumpsMany(self, objs: list[Any]) -> bytes:
+    """Encode many records into one buffer."""
+    pack: Callable[..., bytes] = self._struct.pack
+    getter: Callable[[Any], Any] = self._getter
+    return b''.join([pack(*getter(obj)) for obj in objs])
+
+  def LoadsMany(self, data: bytes) -> list[Any]:
+    """Decode a buffer from DumpsMany() into a list of records."""
+    cls: type = self._cls
+    return [cls(*values) for values in self._struct.iter_unpack(data)]
+
 
 def BinSerialize(
     obj: Any, file_path: Optional[str] = None,
-    compress: bool = True, key: Optional[bytes] = None) -> bytes:
+    compress: Union[bool, CompressionCodec] = True, key: Optional[bytes] = None,
+    fernet: bool = False, level: Optional[int] = None) -> bytes:
   """Serialize a Python object into a BLOB.
 
-  If encryption is "on", note that the original Fernet deals in URL-safe base64, but we have a
-  copy here (bin_fernet.BinaryFernet) that deals in raw bytes.
+  If encryption is "on", the data is encrypted with AES-256-GCM, unless `fernet` is True. For
+  Fernet, note that the original deals in URL-safe base64, but we have a copy here
+  (bin_fernet.BinaryFernet) that deals in raw bytes. BinDeSerialize() will read either.
 
   Args:
     obj: Any serializable Python object
     file_path: (default None) File full path to optionally save the data to;
         IO failures will be logged and ignored
-    compress: (default True) Compress before saving?
+    compress: (default True) Compress before saving? True uses the default codec ('zstd' if
+        the `zstandard` module is installed, else 'bz2'), False is the same as 'none',
+        or give a CompressionCodec name ('none', 'bz2', 'zstd', 'lz4')
     key: (default None) If given will be interpreted as a Fernet crypto key to use
         (URL-safe base64-encoded 32-byte key; use DeriveKeyFromStaticPassword() to get from string)
+    fernet: (default False) If True will encrypt with Fernet (AES-128-CBC + HMAC-SHA256), the
+        legacy format, instead of AES-256-GCM, which is much faster for large data
+    level: (default None) Compression level: 1 to 9 for 'bz2' (default 9), 1 to 22 for 'zstd'
+        (default 3), 0 to 16 for 'lz4' (default 0); higher is smaller but slower; it is checked
+        against the codec actually used, so give `compress` explicitly when giving `level`
 
   Returns:
     Serialized binary data (bytes) corresponding to obj
+
+  Raises:
+    Error: unknown or unavailable compression codec, or invalid `level` for the codec
   """
-  # serialize
-  with Timer() as tm_pickle:
-    s_obj: bytes = pickle.dumps(obj, protocol=-1)
-  # compress, if needed
-  with Timer() as tm_compress:
-    c_obj: bytes = bz2.compress(s_obj, 9) if compress else s_obj
-  # encrypt, if needed
-  with Timer() as tm_crypto:
-    e_obj: bytes = c_obj if key is None else Encrypt(c_obj, key)
-  # output some logs, with measurements
-  logging.info(
-      'SERIALIZATION: %s serial (%s pickle)%s%s',
-      HumanizedBytes(len(s_obj)), tm_pickle.readable,
-      f'; {HumanizedBytes(len(c_obj))} compressed ({tm_compress.readable})' if compress else '',
-      '' if key is None else f'; {HumanizedBytes(len(e_obj))} encrypted ({tm_crypto.readable})')
+  codec: CompressionCodec = _CompressionCodec(compress, level)
+  # serialize, compress and encrypt, as needed, in a single pass
+  with Timer() as tm_serial:
+    if codec == 'none' and key is None:
+      e_obj: bytes = pickle.dumps(obj, protocol=_PICKLE_PROTOCOL)
+      serial_size: int = len(e_obj)
+      c_size: int = serial_size
+    else:
+      chunks: list[bytes] = []
+      serial_size, c_size, _ = _SerializeTo(
+          obj, chunks.append, codec, None if fernet else key, level)
+      e_obj = b''.join(chunks)
+    if key is not None and fernet:
+      e_obj = Encrypt(e_obj, key)
+  # output some logs, with measurements (only pay for formatting them if they will be logged)
+  if _ROOT_LOGGER.isEnabledFor(logging.INFO):
+    logging.info(
+        'SERIALIZATION: %s serial%s%s (%s pickle%s%s)',
+        HumanizedBytes(serial_size),
+        '' if codec == 'none' else f'; {HumanizedBytes(c_size)} {codec}',
+        '' if key is None else f'; {HumanizedBytes(len(e_obj))} encrypted',
+        tm_serial.readable, '' if codec == 'none' else f'+{codec}',
+        '' if key is None else ('+fernet' if fernet else '+aes-gcm'))
   # optionally save to disk
   if file_path is not None:
     with Timer() as tm_save:
       with open(file_path, 'wb') as file_obj:
         file_obj.write(e_obj)
-    logging.info('Bin file saved: %r (%s)', file_path, tm_save.readable)
+    if _ROOT_LOGGER.isEnabledFor(logging.INFO):
+      logging.info('Bin file saved: %r (%s)', file_path, tm_save.readable)
   return e_obj
 
 
@@ -479,14 +1685,16 @@ def BinDeSerialize(
     compress: bool = True, key: Optional[bytes] = None) -> Any:
   """De-Serializes a BLOB back to a Python object.
 
-  If encryption is "on", note that the original Fernet deals in URL-safe base64, but we have a
-  copy here (bin_fernet.BinaryFernet) that deals in raw bytes.
+  If encryption is "on", the algorithm (AES-256-GCM or the legacy Fernet) is detected from the data.
+  Other exceptions from unpickling good data go through unchanged: ImportError/AttributeError for
+  classes (or modules) that are not there anymore, MemoryError, etc.
 
   Args:
     data: (default None) BLOB (binary data string)
     file_path: (default None) File full path to optionally load the data from;
         if you use this option, then `data` WILL BE IGNORED and errors will be fatal
-    compress: (default True) Compress before saving?
+    compress: (default True) Ignored, kept for compatibility: the compression codec (if any)
+        is detected from the data itself
     key: (default None) If given will be interpreted as a Fernet crypto key to use
         (URL-safe base64-encoded 32-byte key; use DeriveKeyFromStaticPassword() to get from string)
 
@@ -495,8 +1703,11 @@ def BinDeSerialize(
     given and does not exist in config dir
 
   Raises:
-    Error: file not found
+    Error: file not found, data compressed with an unavailable codec, or corrupt data (the
+        codec's checks failed, or pickle found bad data; the original exception is the cause)
+    bin_fernet.InvalidToken: wrong key, or invalid/tampered encrypted data
   """
+  del compress  # unused: kept only for API compatibility
   if file_path is None:
     # no disk operation needed
     if data is None:
@@ -509,20 +1720,126 @@ def BinDeSerialize(
     with Timer() as tm_load:
       with open(file_path, 'rb') as file_obj:
         e_obj = file_obj.read()
-    logging.info('Read bin file: %r (%s)', file_path, tm_load.readable)
-  # we have the data; decrypt, if needed
-  with Timer() as tm_crypto:
-    c_obj: bytes = e_obj if key is None else Decrypt(e_obj, key)
-  # decompress, if needed
-  with Timer() as tm_decompress:
-    s_obj: bytes = bz2.decompress(c_obj) if compress else c_obj
-  # create the actual object
-  with Timer() as tm_pickle:
-    obj: Any = pickle.loads(s_obj)  # nosec - this is dangerous!
-  # output some logs, with measurements
-  logging.info(
-      'DE-SERIALIZATION: %s serial (%s pickle)%s%s',
-      HumanizedBytes(len(s_obj)), tm_pickle.readable,
-      f'; {HumanizedBytes(len(c_obj))} compressed ({tm_decompress.readable})' if compress else '',
-      '' if key is None else f'; {HumanizedBytes(len(e_obj))} encrypted ({tm_crypto.readable})')
+    if _ROOT_LOGGER.isEnabledFor(logging.INFO):
+      logging.info('Read bin file: %r (%s)', file_path, tm_load.readable)
+  # we have the data; decrypt, if needed: this cannot be streamed into pickle because the
+  # data is only authenticated at the end, and we must never unpickle unauthenticated data
+  with Timer() as tm_serial:
+    c_obj: bytes = (
+        e_obj if key is None else
+        (_DecryptAESGCM if e_obj.startswith(_AES_GCM_TAG) else Decrypt)(e_obj, key))
+    # decompress, if needed, and create the actual object, in a single pass
+    with _DeserializationErrors():
+      reader, codec = _DecompressingReader(c_obj)
+      with _PausedGC():
+        if reader is None:
+          obj: Any = pickle.loads(c_obj)  # nosec - this is dangerous!
+          serial_size: int = len(c_obj)
+        else:
+          with reader:
+            obj, serial_size = _PickleLoadAll(reader)
+  # output some logs, with measurements (only pay for formatting them if they will be logged)
+  if _ROOT_LOGGER.isEnabledFor(logging.INFO):
+    logging.info(
+        'DE-SERIALIZATION: %s serial%s%s (%s pickle%s%s)',
+        HumanizedBytes(serial_size),
+        '' if codec == 'none' else f'; {HumanizedBytes(len(c_obj))} {codec}',
+        '' if key is None else f'; {HumanizedBytes(len(e_obj))} encrypted',
+        tm_serial.readable, '' if codec == 'none' else f'+{codec}',
+        '' if key is None else ('+aes-gcm' if e_obj.startswith(_AES_GCM_TAG) else '+fernet'))
+  return obj
+
+
+def BinSerializeToFile(
+    obj: Any, file_path: str, compress: Union[bool, CompressionCodec] = True,
+    key: Optional[bytes] = None, level: Optional[int] = None) -> None:
+  """Serialize a Python object straight into a file, without ever building the BLOB in memory.
+
+  Same as BinSerialize(obj, file_path, ...), but better for large objects, as the data is written
+  to the file as it is pickled (and compressed and encrypted). Only AES-256-GCM encryption is
+  supported, not the legacy Fernet. The file can be read by BinDeSerialize() as usual.
+
+  The data is streamed into a temporary file in the same directory, that only replaces
+  `file_path` once complete, so if serialization fails (or is interrupted) an existing file is
+  left intact.
+
+  Args:
+    obj: Any serializable Python object
+    file_path: File full path to save the data to
+    compress: (default True) Compress before saving? Same as for BinSerialize()
+    key: (default None) If given will be interpreted as a crypto key to use
+        (URL-safe base64-encoded 32-byte key; use DeriveKeyFromStaticPassword() to get from string)
+    level: (default None) Compression level; same as for BinSerialize()
+
+  Raises:
+    Error: unknown or unavailable compression codec, or invalid `level` for the codec
+  """
+  codec: CompressionCodec = _CompressionCodec(compress, level)
+  tmp_path: str = f'{file_path}.{os.urandom(4).hex()}.tmp'  # same dir: os.replace() is atomic
+  with Timer() as tm_serial:
+    try:
+      with open(tmp_path, 'xb') as file_obj:  # (not mkstemp(): keep the usual file permissions)
+        serial_size, c_size, e_size = _SerializeTo(obj, file_obj.write, codec, key, level)
+      os.replace(tmp_path, file_path)
+    except BaseException:
+      with contextlib.suppress(OSError):
+        os.remove(tmp_path)
+      raise
+  if _ROOT_LOGGER.isEnabledFor(logging.INFO):
+    logging.info(
+        'SERIALIZATION: %r: %s serial%s%s (%s pickle%s%s+save)',
+        file_path, HumanizedBytes(serial_size),
+        '' if codec == 'none' else f'; {HumanizedBytes(c_size)} {codec}',
+        '' if key is None else f'; {HumanizedBytes(e_size)} encrypted',
+        tm_serial.readable, '' if codec == 'none' else f'+{codec}',
+        '' if key is None else '+aes-gcm')
+
+
+def BinDeSerializeFromFile(file_path: str, key: Optional[bytes] = None) -> Any:
+  """De-Serializes a file back to a Python object, without ever reading the whole file in memory.
+
+  Same as BinDeSerialize(file_path=file_path, ...), but better for large files: the file is
+  memory mapped (or read, if not compressed) and decompressed as it is unpickled. This is NOT
+  possible for encrypted data, as it must be authenticated as a whole before being unpickled, so
+  if `key` is given this just calls BinDeSerialize(). Exceptions are also the same as for it.
+
+  Args:
+    file_path: File full path to load the data from
+    key: (default None) If given will be interpreted as a crypto key to use
+        (URL-safe base64-encoded 32-byte key; use DeriveKeyFromStaticPassword() to get from string)
+
+  Returns:
+    De-Serialized Python object corresponding to the file data
+
+  Raises:
+    Error: file not found, data compressed with an unavailable codec, or corrupt data
+    bin_fernet.InvalidToken: wrong key, or invalid/tampered encrypted data
+  """
+  if key is not None:
+    return BinDeSerialize(file_path=file_path, key=key)
+  if not os.path.exists(file_path):
+    raise Error(f'File {file_path!r} not found')
+  with Timer() as tm_serial, _PausedGC():
+    with open(file_path, 'rb') as file_obj:
+      magic: bytes = file_obj.read(max(len(_BZ2_MAGIC), len(_ZSTD_MAGIC), len(_LZ4_MAGIC)))
+      file_obj.seek(0)
+      if not magic.startswith((_BZ2_MAGIC, _ZSTD_MAGIC, _LZ4_MAGIC)):
+        with _DeserializationErrors():
+          obj: Any = pickle.load(file_obj)  # nosec - this is dangerous!
+        serial_size: int = file_obj.tell()
+        c_size: int = serial_size
+        codec: CompressionCodec = 'none'
+      else:
+        with mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ) as data:
+          c_size = len(data)
+          with _DeserializationErrors():
+            reader, codec = _DecompressingReader(data)
+            with reader:  # type: ignore
+              obj, serial_size = _PickleLoadAll(reader)  # type: ignore
+  if _ROOT_LOGGER.isEnabledFor(logging.INFO):
+    logging.info(
+        'DE-SERIALIZATION: %r: %s serial%s (%s load+pickle%s)',
+        file_path, HumanizedBytes(serial_size),
+        '' if codec == 'none' else f'; {HumanizedBytes(c_size)} {codec}',
+        tm_serial.readable, '' if codec == 'none' else f'+{codec}')
   return obj
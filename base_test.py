@@ -6,12 +6,28 @@
 """base.py unittest."""
 
 import base64
+import concurrent.futures
+import contextlib
+import dataclasses
+import datetime
+import gc
+import hashlib
+import io
+import json
+import logging
+import math
+import multiprocessing
 import os.path
 # import pdb
+import random
+import sys
 import tempfile
 import time
+from typing import Any, NamedTuple, Optional
 import unittest
-# from unittest import mock
+from unittest import mock
+import uuid
+import warnings
 
 from baselib import base
 
@@ -19,49 +35,341 @@ __author__ = 'balparda@gmail.com (Daniel Balparda)'
 __version__ = (1, 0)
 
 
+# golden SHA-256 vectors: data -> expected hex digest (not recomputed, so a broken hash shows)
+_SHA256_VECTORS: dict[bytes, str] = {
+    b'': 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855',
+    b'abc123': '6ca13d52ca70c883e0f0bb101e425a89e8624de51db2d2392593af6a84118090',
+    b'x' * 4096: 'a2e659dacb4691e887ac0139f8893d04764ee197d70fb73d3190d56113d18e3e',
+    b'y' * 4097: 'ff08f7c208970029bac126ddc0f566b9bff3df5eabb9d55731e7cfbfb5fdeed5',
+    # 1x1 black RGB image pixels
+    b'\x00' * 3: '709e80c88487a2411e1ee4dfb9f22a861492d20c4765150c0c794abd70f8147c',
+}
+
+
+def _SerializeInChild(obj: Any) -> None:
+  """Round-trip `obj` through multi-stream bz2 (uses the compression thread pool), in a child."""
+  if base.BinDeSerialize(base.BinSerialize(obj, compress='bz2', level=1)) != obj:
+    raise base.Error('Round trip failed')
+
+
+class _GCProbe:
+  """Records if the garbage collector was enabled when it was unpickled."""
+
+  def __init__(self) -> None:
+    """Construct."""
+    self.gc_enabled: Optional[bool] = None
+
+  def __getstate__(self) -> dict[str, Any]:
+    """Pickle."""
+    return {'gc_enabled': None}
+
+  def __setstate__(self, state: dict[str, Any]) -> None:
+    """Unpickle."""
+    del state
+    self.gc_enabled = gc.isenabled()
+
+
 class TestBase(unittest.TestCase):
   """Tests for base.py."""
 
+  _CRYPTO_KEY: bytes = b'LRtw2A4U9PAtihUow5p_eQex6IYKM7nUoPlf1fkKPgc='  # cspell:disable-line
+  _PLAINTEXT: bytes = b'the force will be with you... always'
+  _CIPHER: bytes = bytes.fromhex(  # _PLAINTEXT encrypted with _CRYPTO_KEY (no expiration check)
+      '80000000006ad10507ddcc489c5826c0da28fe3dfc32523dee5d582eeaf3b863ea94dd'
+      '882e4a5fe9b207c0aa03508678ebc158743f795544dff2f6cfbb7c5be298cd7866534d'
+      '6b345e827514f1d993028f8cb879efb91342ea5c8710c7fbe24c0dc5285985416eac21')
+  block_encoder: base.BlockEncoder256
+  tiny_black_img: base.Image.Image
+  big_obj: tuple[list[bytes], list[int], bytes]
+  tmp_dir: str
+
+  @classmethod
+  def setUpClass(cls):
+    """Build shared fixtures once (the AES key schedule, for one), not in every test."""
+    super().setUpClass()
+    cls.block_encoder = base.BlockEncoder256(base64.urlsafe_b64decode(cls._CRYPTO_KEY))
+    cls.tiny_black_img = base.Image.new('RGB', (1, 1), color=(0, 0, 0))
+    # large enough for many pickle frames and many parallel bz2 blocks: don't change it in tests
+    cls.big_obj = ([bytes(range(256))] * 2000, list(range(300000)), b'x' * 1000000)
+    tmp_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+    cls.addClassCleanup(tmp_dir.cleanup)
+    cls.tmp_dir = tmp_dir.name  # for all the tests' files: give them unique names
+
+  def setUp(self):
+    """Save the root logger state, as tests change it freely: restored by tearDown()."""
+    super().setUp()
+    root_logger = logging.getLogger()
+    self._logger_state = (root_logger.level, list(root_logger.handlers), base._STDERR_HANDLER)
+
+  def tearDown(self):
+    """Restore the root logger state, so no test leaks levels or handlers into the next."""
+    root_logger = logging.getLogger()
+    level, handlers, base._STDERR_HANDLER = self._logger_state
+    root_logger.setLevel(level)
+    root_logger.handlers[:] = handlers
+    super().tearDown()
+
+  def test_StartStdErrLogging(self):
+    """Test."""
+    root_logger = logging.getLogger()
+    root_logger.handlers.clear()  # only our own handler, writing to `stdout`; tearDown() restores
+    base._STDERR_HANDLER = None
+    stdout = io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+      base.StartStdErrLogging()
+      base.StartStdErrLogging(log_process=True)  # replaces the first handler
+      logging.info('some message')
+      logging.debug('not logged')
+    self.assertListEqual(root_logger.handlers, [base._STDERR_HANDLER])
+    self.assertEqual(stdout.getvalue().count('some message'), 1)
+    process: str = multiprocessing.current_process().name  # tests may run in worker processes
+    self.assertIn(f'INFO[{process}.test_StartStdErrLogging]: some message', stdout.getvalue())
+    self.assertNotIn('not logged', stdout.getvalue())
+
   def test_TimeString(self):
     """Test."""
     self.assertEqual(base.STD_TIME_STRING(1675788907), '2023/Feb/07-16:55:07-UTC')
+    self.assertEqual(base.StdTimeString(1675788907.9), '2023/Feb/07-16:55:07-UTC')
+    self.assertEqual(base.StdTimeString(0), '-')
+    self.assertEqual(base.StdTimeString(0.5), '1970/Jan/01-00:00:00-UTC')
+    self.assertEqual(base.StdTimeString(-0.5), '1969/Dec/31-23:59:59-UTC')
+    base._StdTimeStringCached.cache_clear()
+    for t in (1675788907, 1675788907.2, 1675788907.7):
+      self.assertEqual(base.StdTimeString(t), '2023/Feb/07-16:55:07-UTC')
+    self.assertEqual(base._StdTimeStringCached.cache_info().hits, 2)
+    self.assertEqual(base.IntTime(_time=lambda: 1675788907.9), 1675788907)
+    self.assertIsInstance(base.INT_TIME(), int)
+    self.assertTrue(base.STR_TIME().endswith('-UTC'))
+
+  @unittest.skipUnless(base.np, 'numpy module not installed')
+  def test_StdTimeStrings(self):
+    """Test."""
+    times = [1675788907, 0, 0.5, -0.5, 1675788907.9, 951782400, 4102444799, -30610224000]
+    self.assertListEqual(
+        base.StdTimeStrings(times).tolist(), [base.StdTimeString(t) for t in times])
+    times = base.np.arange(-10 ** 10, 10 ** 10, 9876543, dtype=base.np.int64).reshape(-1, 2)
+    strings = base.StdTimeStrings(times)
+    self.assertTupleEqual(strings.shape, times.shape)
+    self.assertListEqual(
+        strings.ravel().tolist(), [base.StdTimeString(t) for t in times.ravel().tolist()])
+    self.assertListEqual(  # years without 4 digits go through the slow path
+        base.StdTimeStrings([-62135596800, 1675788907]).tolist(),
+        [base.StdTimeString(-62135596800), '2023/Feb/07-16:55:07-UTC'])
+    self.assertEqual(base.StdTimeStrings([]).size, 0)
+    with mock.patch.object(base, 'np', None):
+      with self.assertRaisesRegex(base.Error, 'needs the `numpy` module'):
+        base.StdTimeStrings([1])
+
+  def test_PrivateDir(self):
+    """Test."""
+    self.assertEqual(base.PRIVATE_DIR(base.USER_DIRECTORY + 'foo/bar'), '~/foo/bar')
+    self.assertEqual(base.PrivateDir('/some/path'), '/some/path')
+    self.assertEqual(base.PrivateDir('/some/path'), '/some/path')
+    self.assertGreaterEqual(base.PrivateDir.cache_info().hits, 1)
+
+  def test_BytesHash(self):
+    """Test."""
+    base._CachedBytesBinHash.cache_clear()
+    for data in (b'', b'abc123', b'x' * 4096, b'y' * 4097, bytearray(b'abc123')):
+      expected: str = _SHA256_VECTORS[bytes(data)]
+      self.assertEqual(base.BytesBinHash(data), bytes.fromhex(expected))
+      self.assertEqual(base.BytesHexHash(data), expected)
+    # only the small immutable ones got cached, and the repeated calls were cache hits
+    cache_info = base._CachedBytesBinHash.cache_info()
+    self.assertEqual(cache_info.currsize, 3)
+    self.assertEqual(cache_info.hits, 3)
+
+  def test_HashBackend(self):
+    """Test."""
+    # the hashes are only cheap enough to use freely with OpenSSL's SHA-256 (that uses the CPU's
+    # SHA extensions when there are any); a build without it silently falls back to a much
+    # slower implementation, so flag it here, as no correctness test would notice
+    backend: str = type(hashlib.sha256()).__module__
+    if backend != '_hashlib':
+      warnings.warn(
+          f'hashlib.sha256 is not OpenSSL-backed ({backend}): hashing will be slow', RuntimeWarning)
+      self.skipTest(f'hashlib.sha256 is not OpenSSL-backed ({backend})')
+    self.assertEqual(hashlib.sha256.__name__, 'openssl_sha256')
+
+  def test_FileHexHash(self):
+    """Test."""
+    # a small file
+    tmp_file = os.path.join(self.tmp_dir, 'small.bin')
+    with open(tmp_file, 'wb') as file_obj:
+      file_obj.write(b'abc123')
+    self.assertEqual(base.FileHexHash(tmp_file), _SHA256_VECTORS[b'abc123'])
+    # a file spanning several read chunks, the last one partial
+    data = bytes(range(256)) * ((base._HASH_CHUNK_SIZE * 5 // 2) // 256)
+    tmp_file = os.path.join(self.tmp_dir, 'large.bin')
+    with open(tmp_file, 'wb') as file_obj:
+      file_obj.write(data)
+    expected: str = hashlib.sha256(data).hexdigest()  # size depends on _HASH_CHUNK_SIZE
+    self.assertEqual(base.FileHexHash(tmp_file), expected)
+    # same file, but as if it were large enough to be memory mapped
+    with mock.patch.object(base, '_HASH_MMAP_MIN_SIZE', base._HASH_CHUNK_SIZE):
+      self.assertEqual(base.FileHexHash(tmp_file), expected)
+    # same file, but as if in Python < 3.11 (no hashlib.file_digest())
+    with mock.patch.object(base, '_HAS_FILE_DIGEST', False):
+      self.assertEqual(base.FileHexHash(tmp_file), expected)
+    # an empty file
+    tmp_file = os.path.join(self.tmp_dir, 'empty.bin')
+    with open(tmp_file, 'wb') as file_obj:
+      pass
+    self.assertEqual(base.FileHexHash(tmp_file), _SHA256_VECTORS[b''])
+    with self.assertRaisesRegex(base.Error, 'not found'):
+      base.FileHexHash(os.path.join(self.tmp_dir, 'missing.bin'))
+
+  def test_ImageHexHash(self):
+    """Test."""
+    # golden vector: does not depend on Pillow's tobytes() to say what the pixels are
+    self.assertEqual(base.ImageHexHash(self.tiny_black_img), _SHA256_VECTORS[b'\x00' * 3])
+    # noise images, of many modes and sizes, against the pixels hashed in one go
+    for mode, size in (('RGB', (1, 1)), ('RGB', (640, 480)), ('RGBA', (123, 45)), ('L', (1000, 1)),
+                       ('1', (33, 17)), ('P', (50, 50)), ('I;16', (20, 30)), ('F', (7, 7)),
+                       ('RGB', (0, 0)), ('L', (10, 0))):
+      if size[0] and size[1]:
+        img = base.Image.effect_noise(size, 64).convert(mode)
+      else:
+        img = base.Image.new(mode, size)  # empty image
+      self.assertEqual(
+          base.ImageHexHash(img), hashlib.sha256(img.tobytes()).hexdigest(),
+          msg=f'{mode} {size}')
+    # every mode, hashed in many bands of rows (the last one shorter), is the same as in one go
+    rand = random.Random(42)
+    with mock.patch.object(base, '_IMAGE_HASH_BLOCK_SIZE', 100):
+      for mode in ('1', 'CMYK', 'F', 'HSV', 'I', 'I;16', 'I;16B', 'I;16L', 'I;16N', 'L', 'LA', 'La',
+                   'LAB', 'P', 'PA', 'RGB', 'RGBA', 'RGBa', 'RGBX', 'YCbCr'):  # Image.MODES
+        row_size = len(base.Image.new(mode, (37, 1)).tobytes())
+        img = base.Image.frombytes(mode, (37, 61), rand.randbytes(row_size * 61))
+        self.assertEqual(
+            base.ImageHexHash(img), hashlib.sha256(img.tobytes()).hexdigest(), msg=mode)
+
+  def test_Json(self):
+    """Test."""
+    obj = {'a': [1, 2.5, None, True, 'é'], 'b': {'c': -3}}
+    for orjson in (base.orjson, None):
+      with mock.patch.object(base, 'orjson', orjson):
+        self.assertDictEqual(base.StringToJson(base.JsonToString(obj)), obj)
+        self.assertDictEqual(base.StringToJson(base.JsonToString(obj, human_readable=False)), obj)
+        self.assertDictEqual(base.BytesToJson(base.JsonToBytes(obj)), obj)
+        self.assertEqual(base.JsonToString({'a': [1]}), '{\n    "a": [\n        1\n    ]\n}')
+        # things orjson won't do, json will
+        self.assertEqual(base.JsonToBytes({1: 2 ** 70}), b'{"1": 1180591620717411303424}')
+        self.assertTrue(math.isnan(base.BytesToJson(b'{"a": NaN}')['a']))
+        self.assertTrue(math.isnan(base.StringToJson('[NaN]', fast=True)[0]))  # type: ignore
+        with self.assertRaises(ValueError):
+          base.BytesToJson(b'{"a": ')
+        with self.assertRaises(ValueError):
+          base.StringToJson('[1, 2')
+        self.assertDictEqual(base.BytesToJson(base.JsonToBytes(obj, fast=True), fast=True), obj)
+        self.assertDictEqual(base.StringToJson(base.JsonToString(obj), fast=True), obj)
+        # by default parsing is the json module's: big integers are kept exactly
+        self.assertDictEqual(base.BytesToJson(base.JsonToBytes({'id': 2 ** 70})), {'id': 2 ** 70})
+        self.assertEqual(base.StringToJson('18446744073709551616'), 2 ** 64)
+        self.assertEqual(base.StringToJson('-9999999999999999999'), -9999999999999999999)
+        # by default the output is the json module's, whether orjson is installed or not
+        self.assertEqual(base.JsonToBytes(obj), json.dumps(obj).encode('utf-8'))
+        self.assertEqual(base.JsonToBytes([math.nan, -math.inf]), b'[NaN, -Infinity]')
+        with self.assertRaises(TypeError):
+          base.JsonToBytes({'a': datetime.datetime(2023, 1, 1)})  # type: ignore
+        with self.assertRaises(TypeError):
+          base.JsonToString([uuid.uuid4()], human_readable=False)  # type: ignore
+    if base.orjson:
+      self.assertEqual(base.JsonToBytes(obj, fast=True),
+                       '{"a":[1,2.5,null,true,"é"],"b":{"c":-3}}'.encode())
+      self.assertEqual(base.JsonToBytes([math.nan], fast=True), b'[null]')  # why it is opt-in
+      self.assertIsInstance(base.StringToJson('18446744073709551616', fast=True), float)  # same
+    self.assertEqual(base.JsonToString({'a': [1, 2]}, human_readable=False, fast=True),
+                     base.JsonToBytes({'a': [1, 2]}, fast=True).decode('utf-8'))
 
   def test_HumanizedBytes(self):
     """Test."""
-    self.assertEqual(base.HumanizedBytes(0), '0b')
-    self.assertEqual(base.HumanizedBytes(10), '10b')
-    self.assertEqual(base.HumanizedBytes(10000), '9.77kb')
-    self.assertEqual(base.HumanizedBytes(10000000), '9.54Mb')
-    self.assertEqual(base.HumanizedBytes(10000000000), '9.31Gb')
-    self.assertEqual(base.HumanizedBytes(10000000000000), '9.09Tb')
-    self.assertEqual(base.HumanizedBytes(10000000000000000), '9094.95Tb')
-    with self.assertRaises(AttributeError):
+    for size, expected in (
+        (0, '0b'), (10, '10b'), (10000, '9.77kb'), (10000000, '9.54Mb'),
+        (10000000000, '9.31Gb'), (10000000000000, '9.09Tb'), (10000000000000000, '9094.95Tb'),
+        # unit boundaries
+        (1023, '1023b'), (1024, '1.00kb'), (1024 ** 2 - 1, '1024.00kb'), (1024 ** 2, '1.00Mb'),
+        (1024 ** 4, '1.00Tb')):
+      self.assertEqual(base.HumanizedBytes(size), expected, msg=size)
+    for power, unit in enumerate(('kb', 'Mb', 'Gb', 'Tb'), start=1):
+      # unit is the one given by the bit length: each 10 bits are one power of 1024
+      self.assertTrue(base.HumanizedBytes(1024 ** power).endswith(unit))
+      self.assertTrue(base.HumanizedBytes(2 ** (10 * power + 9) + 12345).endswith(unit))
+      self.assertFalse(base.HumanizedBytes(1024 ** power - 1).endswith(unit))
+    with self.assertRaises(base.Error):
       base.HumanizedBytes(-1)
+    # results are cached, but ints and floats are kept apart
+    hits = base.HumanizedBytes.cache_info().hits
+    self.assertEqual(base.HumanizedBytes(10000), '9.77kb')
+    self.assertEqual(base.HumanizedBytes.cache_info().hits, hits + 1)
+    self.assertEqual(base.HumanizedBytes(1), '1b')
+    self.assertEqual(base.HumanizedBytes(1.0), '1.0b')
 
   def test_HumanizedDecimal(self):
     """Test."""
-    self.assertEqual(base.HumanizedDecimal(0), '0')
-    self.assertEqual(base.HumanizedDecimal(11), '11')
-    self.assertEqual(base.HumanizedDecimal(12100), '12.10k')
-    self.assertEqual(base.HumanizedDecimal(13200000), '13.20M')
-    self.assertEqual(base.HumanizedDecimal(14300000000), '14.30G')
-    self.assertEqual(base.HumanizedDecimal(15400000000000), '15.40T')
-    self.assertEqual(base.HumanizedDecimal(16500000000000000), '16500.00T')
-    with self.assertRaises(AttributeError):
+    for size, expected in (
+        (0, '0'), (11, '11'), (12100, '12.10k'), (13200000, '13.20M'), (14300000000, '14.30G'),
+        (15400000000000, '15.40T'), (16500000000000000, '16500.00T'),
+        # unit boundaries
+        (999, '999'), (1000, '1.00k'), (999999, '1000.00k'), (1000000, '1.00M'),
+        (1000 ** 4, '1.00T'),
+        (13405, '13.40k')):  # 13.405 is 13.40499... in binary
+      self.assertEqual(base.HumanizedDecimal(size), expected, msg=size)
+    with self.assertRaises(base.Error):
       base.HumanizedDecimal(-1)
 
+  @unittest.skipUnless(base.np, 'numpy module not installed')
+  def test_HumanizedArrays(self):
+    """Test."""
+    np = base.np
+    rng = np.random.default_rng(42)
+    sizes = np.concatenate(
+        [rng.integers(0, 2 ** bits, 2000) for bits in range(1, 54, 4)] +
+        [np.array([0, 999, 1000, 1023, 1024, 1024 ** 2 - 1, 1024 ** 2, 2 ** 53 - 1])])
+    for array_method, method in ((base.HumanizedBytesArray, base.HumanizedBytes),
+                                 (base.HumanizedDecimalArray, base.HumanizedDecimal)):
+      self.assertListEqual(array_method(sizes).tolist(), [method(s) for s in sizes.tolist()])
+      self.assertListEqual(array_method([[1, 2000], [3, 4]]).tolist(),
+                           [[method(1), method(2000)], [method(3), method(4)]])
+      self.assertListEqual(  # floats and huge numbers go the slow way
+          array_method([1.5, 2000.0, 2 ** 60]).tolist(),
+          [method(1.5), method(2000.0), method(2 ** 60)])
+      self.assertEqual(array_method([]).size, 0)
+      with self.assertRaisesRegex(base.Error, 'should be >=0'):
+        array_method([1, -1])
+    times = np.concatenate(
+        [rng.exponential(10.0 ** power, 2000) for power in range(-5, 9)] +
+        [np.round(rng.uniform(0, 100, 2000), 3),  # many ties to round
+         np.array([0, 0.005, 0.0125, 1.005, 1.015, 2.675, 59.995, 0.01, 1, 60, 3600, 86400,
+                   1e300, float('inf'), float('nan')])])
+    self.assertListEqual(
+        base.HumanizedSecondsArray(times).tolist(),
+        [base.HumanizedSeconds(t) for t in times.tolist()])
+    self.assertListEqual(base.HumanizedSecondsArray([[0, 0]]).tolist(), [['0 secs', '0 secs']])
+    with self.assertRaisesRegex(base.Error, 'should be >=0'):
+      base.HumanizedSecondsArray([1, -0.5])
+    with mock.patch.object(base, 'np', None):
+      for array_method in (base.HumanizedBytesArray, base.HumanizedDecimalArray,
+                           base.HumanizedSecondsArray):
+        with self.assertRaisesRegex(base.Error, 'needs the `numpy` module'):
+          array_method([1])
+
   def test_HumanizedSeconds(self):
     """Test."""
-    self.assertEqual(base.HumanizedSeconds(0), '0 secs')
-    self.assertEqual(base.HumanizedSeconds(0.0), '0 secs')
-    self.assertEqual(base.HumanizedSeconds(0.00456789), '4.568 msecs')
-    self.assertEqual(base.HumanizedSeconds(0.456789), '0.4568 secs')
-    self.assertEqual(base.HumanizedSeconds(10), '10.00 secs')
-    self.assertEqual(base.HumanizedSeconds(135), '2.25 mins')
-    self.assertEqual(base.HumanizedSeconds(5000), '1.39 hours')
-    self.assertEqual(base.HumanizedSeconds(100000), '1.16 days')
-    with self.assertRaises(AttributeError):
+    for secs, expected in (
+        (0, '0 secs'), (0.0, '0 secs'), (0.00456789, '4.568 msecs'), (0.456789, '0.4568 secs'),
+        (10, '10.00 secs'), (135, '2.25 mins'),
+        (62.7, '1.05 mins'),  # 62.7 * (1 / 60) gives '1.04'
+        (5000, '1.39 hours'), (100000, '1.16 days')):
+      self.assertEqual(base.HumanizedSeconds(secs), expected, msg=secs)
+    with self.assertRaises(base.Error):
       base.HumanizedSeconds(-1)
+    # only ints are cached
+    hits = base._HumanizedIntSeconds.cache_info().hits
+    self.assertEqual(base.HumanizedSeconds(135), '2.25 mins')
+    self.assertEqual(base.HumanizedSeconds(135.0), '2.25 mins')
+    self.assertEqual(base.HumanizedSeconds(True), '1.00 secs')
+    self.assertEqual(base._HumanizedIntSeconds.cache_info().hits, hits + 1)
 
   def test_DeriveKeyFromStaticPassword(self):
     """Test."""
@@ -69,42 +377,81 @@ class TestBase(unittest.TestCase):
       base.DeriveKeyFromStaticPassword(None)  # type: ignore
     with self.assertRaisesRegex(base.Error, 'Empty passwords'):
       base.DeriveKeyFromStaticPassword('  \n ')
-    with base.Timer(log='DeriveKeyFromStaticPassword - luke'):
+    self.assertEqual(
+        base.DeriveKeyFromStaticPassword('luke'),
+        b'0rCiyBrqWokX9UNBiYzkvhi9ZsjoIyGeUdtkbPAjzaY=')
+    # derived keys are cached, but not by password
+    self.assertNotIn(b'luke', base._DERIVED_KEY_CACHE)
+    with mock.patch.object(base.hashlib, 'pbkdf2_hmac') as pbkdf2_hmac:
       self.assertEqual(
           base.DeriveKeyFromStaticPassword('luke'),
           b'0rCiyBrqWokX9UNBiYzkvhi9ZsjoIyGeUdtkbPAjzaY=')
-    with base.Timer(log='DeriveKeyFromStaticPassword - Ben Star Wars Jedi'):
-      self.assertEqual(
-          base.DeriveKeyFromStaticPassword('Ben Star Wars Jedi'),
-          b'yAK_QpO2RrSqwzzO8relAbl5c_cBgvp_cVPtk1D-Hrw=')  # cspell:disable-line
+      pbkdf2_hmac.assert_not_called()
+    # cache is LRU and bounded
+    with mock.patch.object(base.hashlib, 'pbkdf2_hmac', return_value=b'x' * 32):
+      for i in range(base._DERIVED_KEY_CACHE_ENTRIES):
+        base.DeriveKeyFromStaticPassword(str(i))
+    self.assertEqual(len(base._DERIVED_KEY_CACHE), base._DERIVED_KEY_CACHE_ENTRIES)
+    # safe to call from many threads: cache hits and evictions race each other here
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads as often as possible
+    try:
+      with mock.patch.object(base.hashlib, 'pbkdf2_hmac', return_value=b'x' * 32):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+          keys = set(executor.map(
+              base.DeriveKeyFromStaticPassword, (str(i % 7) for i in range(20000))))
+    finally:
+      sys.setswitchinterval(switch_interval)
+    self.assertSetEqual(keys, {base64.urlsafe_b64encode(b'x' * 32)})
+    base.ClearKeyCache()
+    self.assertEqual(len(base._DERIVED_KEY_CACHE), 0)
+
+  def test_DeriveKeyFromStaticPassword_Jedi(self):
+    """Test."""
+    # its own test so the parallel runner can derive it in another worker (each derivation is slow)
+    self.assertEqual(
+        base.DeriveKeyFromStaticPassword('Ben Star Wars Jedi'),
+        b'yAK_QpO2RrSqwzzO8relAbl5c_cBgvp_cVPtk1D-Hrw=')  # cspell:disable-line
 
   def test_BasicCrypto(self):
     """Test."""
-    crypto_key = b'LRtw2A4U9PAtihUow5p_eQex6IYKM7nUoPlf1fkKPgc='  # cspell:disable-line
-    plaintext = 'the force will be with you... always'.encode('utf-8')
-    cipher = base.Encrypt(plaintext, crypto_key)
+    crypto_key, plaintext, cipher = self._CRYPTO_KEY, self._PLAINTEXT, self._CIPHER
+    # fixed ciphertext: old data must keep decrypting
     self.assertEqual(base.Decrypt(cipher, crypto_key), plaintext)
-    self.assertEqual(len(cipher), 105)
+    # round trip
+    new_cipher = base.Encrypt(plaintext, crypto_key)
+    self.assertEqual(len(new_cipher), 105)
+    self.assertNotEqual(new_cipher, cipher)  # random IV (and time stamp)
+    self.assertEqual(base.Decrypt(new_cipher, crypto_key), plaintext)
     with self.assertRaises(base.bin_fernet.InvalidToken):
       base.Decrypt(cipher, b'0rCiyBrqWokX9UNBiYzkvhi9ZsjoIyGeUdtkbPAjzaY=')  # wrong key
     with self.assertRaises(base.bin_fernet.InvalidToken):
       base.Decrypt(cipher[5:], crypto_key)  # truncated ciphertext
     with self.assertRaises(ValueError):
       base.Encrypt(plaintext, crypto_key[10:])  # invalid key format
+    # key setup is cached, and can be dropped
+    self.assertIs(base._Fernet(crypto_key), base._Fernet(crypto_key))
+    base.ClearKeyCache()
+    self.assertEqual(base._Fernet.cache_info().currsize, 0)
+    self.assertEqual(base.Decrypt(cipher, crypto_key), plaintext)
 
   def test_BlockEncoder256(self):
     """Test."""
-    crypto_key = b'LRtw2A4U9PAtihUow5p_eQex6IYKM7nUoPlf1fkKPgc='  # cspell:disable-line
     digest = 'a771d3bd9b432b720b2bcebd3c4675d6d27d5868c5ce05261728ec9844b78a70'
     crypt_digest = 'd2ffc6e722eb0ae2db38b52796f4a13b0f1ace0befab9cdf265771951f9f89d6'
     bin_digest = bytes.fromhex(digest)
-    encoder = base.BlockEncoder256(base64.urlsafe_b64decode(crypto_key))
+    encoder = self.block_encoder
     bin_cipher = encoder.EncryptBlock256(bin_digest)
     self.assertEqual(bin_cipher.hex(), crypt_digest)
     self.assertEqual(encoder.DecryptBlock256(bin_cipher), bin_digest)
     hex_cipher = encoder.EncryptHexdigest256(digest)
     self.assertEqual(hex_cipher, crypt_digest)
     self.assertEqual(encoder.DecryptHexdigest256(hex_cipher), digest)
+    # contexts are reused: repeated and interleaved calls must be independent
+    self.assertEqual(encoder.EncryptBlock256(bin_digest), bin_cipher)
+    self.assertEqual(encoder.EncryptBlock256(bin_digest), bin_cipher)
+    self.assertEqual(encoder.DecryptBlock256(bin_cipher), bin_digest)
+    self.assertEqual(encoder.EncryptBlock256(bin_digest), bin_cipher)
     with self.assertRaises(base.Error):
       base.BlockEncoder256(b'abcd')
     with self.assertRaises(base.Error):
@@ -119,6 +466,55 @@ class TestBase(unittest.TestCase):
       encoder.EncryptHexdigest256('abc')
     with self.assertRaises(ValueError):
       encoder.DecryptHexdigest256('abc')
+    # batch versions
+    digests = [digest, crypt_digest, digest]
+    bin_digests = [bytes.fromhex(d) for d in digests]
+    bin_ciphers = encoder.EncryptBlocks256(bin_digests)
+    self.assertListEqual(bin_ciphers, [encoder.EncryptBlock256(d) for d in bin_digests])
+    self.assertListEqual(encoder.DecryptBlocks256(bin_ciphers), bin_digests)
+    hex_ciphers = encoder.EncryptHexdigests256(digests)
+    self.assertListEqual(hex_ciphers, [c.hex() for c in bin_ciphers])
+    self.assertListEqual(encoder.DecryptHexdigests256(hex_ciphers), digests)
+    self.assertListEqual(encoder.EncryptBlocks256([]), [])
+    self.assertListEqual(encoder.DecryptHexdigests256([]), [])
+    with self.assertRaises(base.Error):
+      encoder.EncryptBlocks256([bin_digest, b'abcd'])
+    with self.assertRaises(base.Error):
+      encoder.DecryptBlocks256([b'abcd'])
+    with self.assertRaises(base.Error):
+      encoder.EncryptHexdigests256([digest, 'abcd'])
+    with self.assertRaises(base.Error):
+      encoder.DecryptHexdigests256(['abcd'])
+
+  def test_StructCodec(self):
+    """Test."""
+
+    @dataclasses.dataclass
+    class _Point:
+      x: float
+      y: float
+      point_id: int
+      active: bool
+
+    class _Count(NamedTuple):
+      count: int
+
+    codec = base.StructCodec(_Point)
+    self.assertEqual(codec.size, 25)
+    point = _Point(1.5, -2.25, 10 ** 12, True)
+    self.assertEqual(codec.Loads(codec.Dumps(point)), point)
+    points = [_Point(float(i), i / 3, -i, i % 2 == 0) for i in range(100)]
+    data = codec.DumpsMany(points)
+    self.assertEqual(len(data), 100 * 25)
+    self.assertListEqual(codec.LoadsMany(data), points)
+    self.assertListEqual(codec.LoadsMany(b''), [])
+    codec = base.StructCodec(_Count)
+    self.assertEqual(codec.Loads(codec.Dumps(_Count(7))), _Count(7))
+    self.assertListEqual(codec.LoadsMany(codec.DumpsMany([_Count(1), _Count(2)])), [(1,), (2,)])
+    with self.assertRaisesRegex(base.Error, 'no annotated fields'):
+      base.StructCodec(object)
+    with self.assertRaisesRegex(base.Error, r"\['name'\] are not int/float/bool"):
+      base.StructCodec(NamedTuple('_Bad', [('count', int), ('name', str)]))
 
   def test_Serialize(self):
     """Test."""
@@ -130,43 +526,366 @@ class TestBase(unittest.TestCase):
     serial = base.BinSerialize(({5: 6, 7: 8}, [9, 10]), compress=False)
     obj = base.BinDeSerialize(serial, compress=False)
     self.assertTupleEqual(obj, ({5: 6, 7: 8}, [9, 10]))
+    # compression is detected from the data, so the `compress` flag is irrelevant when loading
+    serial = base.BinSerialize(({1: 2, 3: 4}, []), compress='bz2')
+    self.assertTrue(serial.startswith(b'BZh'))
+    self.assertTupleEqual(base.BinDeSerialize(serial, compress=False), ({1: 2, 3: 4}, []))
+    serial = base.BinSerialize(({1: 2, 3: 4}, []), compress='none')
+    self.assertTupleEqual(base.BinDeSerialize(serial), ({1: 2, 3: 4}, []))
+    with self.assertRaisesRegex(base.Error, 'Unknown compression codec'):
+      base.BinSerialize([1, 2], compress='foo')  # type: ignore
+    with mock.patch.object(base, 'zstandard', None):
+      with self.assertRaisesRegex(base.Error, 'needs the `zstandard` module'):
+        base.BinSerialize([1, 2], compress='zstd')
+      self.assertTrue(base.BinSerialize([1, 2]).startswith(b'BZh'))  # default falls back to bz2
+
+  def test_Serialize_encrypted(self):
+    """Test."""
     # do encrypted uncompressed memory serialization test
-    crypto_key = b'LRtw2A4U9PAtihUow5p_eQex6IYKM7nUoPlf1fkKPgc='  # cspell:disable-line
-    serial = base.BinSerialize(({10: 9, 8: 7}, {6, 5}), compress=False, key=crypto_key)
-    obj = base.BinDeSerialize(serial, compress=False, key=crypto_key)
+    serial = base.BinSerialize(({10: 9, 8: 7}, {6, 5}), compress=False, key=self._CRYPTO_KEY)
+    obj = base.BinDeSerialize(serial, compress=False, key=self._CRYPTO_KEY)
     self.assertTupleEqual(obj, ({10: 9, 8: 7}, {6, 5}))
     # do encrypted and compressed memory serialization test
-    serial = base.BinSerialize(({100: 90, 80: 70}, {60, 50}), compress=True, key=crypto_key)
-    obj = base.BinDeSerialize(serial, key=crypto_key)
+    serial = base.BinSerialize(({100: 90, 80: 70}, {60, 50}), compress=True, key=self._CRYPTO_KEY)
+    obj = base.BinDeSerialize(serial, key=self._CRYPTO_KEY)
     self.assertTupleEqual(obj, ({100: 90, 80: 70}, {60, 50}))
+    # encryption defaults to AES-GCM, but legacy Fernet is still supported, and both are detected
+    serial = base.BinSerialize([1, 2], key=self._CRYPTO_KEY)
+    self.assertTrue(serial.startswith(b'\x01'))
+    self.assertListEqual(base.BinDeSerialize(serial, key=self._CRYPTO_KEY), [1, 2])
+    fernet_serial = base.BinSerialize([1, 2], key=self._CRYPTO_KEY, fernet=True)
+    self.assertTrue(fernet_serial.startswith(b'\x80'))
+    self.assertListEqual(base.BinDeSerialize(fernet_serial, key=self._CRYPTO_KEY), [1, 2])
+    wrong_key = b'0rCiyBrqWokX9UNBiYzkvhi9ZsjoIyGeUdtkbPAjzaY='  # cspell:disable-line
+    for bad_serial, bad_key in ((serial, wrong_key), (serial[:-1], self._CRYPTO_KEY),
+                                (serial[:20], self._CRYPTO_KEY), (fernet_serial, wrong_key)):
+      with self.assertRaises(base.bin_fernet.InvalidToken):
+        base.BinDeSerialize(bad_serial, key=bad_key)
+    with self.assertRaises(ValueError):
+      base.BinSerialize([1, 2], key=self._CRYPTO_KEY[10:])  # invalid key format
+    # AES-GCM uses its own HKDF subkey, not the raw key (that Fernet also uses); fixed vector
+    self.assertNotEqual(
+        base._AESGCMKey(self._CRYPTO_KEY), base64.urlsafe_b64decode(self._CRYPTO_KEY))
+    self.assertListEqual(base.BinDeSerialize(bytes.fromhex(
+        '01614fedb0170297a70ca8c0ffe17f2eb3e0c35761f0624d64083b5e0ff2b5ae4a59a87043fbdc59161fe9bd'
+        '975d078d7e'), key=self._CRYPTO_KEY), [1, 2])
+    self.assertIs(  # cached, and can be dropped
+        base._AESGCMKey(self._CRYPTO_KEY), base._AESGCMKey(self._CRYPTO_KEY))
+    base.ClearKeyCache()
+    self.assertEqual(base._AESGCMKey.cache_info().currsize, 0)
+
+  def test_Serialize_bz2_parallel(self):
+    """Test."""
+    # compression is streamed from pickle, so check a large object (many pickle frames)
+    big_pickle = base.pickle.dumps(self.big_obj, protocol=5)
+    serial = base.BinSerialize(self.big_obj, compress='bz2')
+    self.assertEqual(base.bz2.decompress(serial), big_pickle)
+    self.assertTupleEqual(base.BinDeSerialize(serial), self.big_obj)
+    self.assertEqual(  # compressed in parallel blocks, one stream each
+        serial.count(b'BZh91AY&SY'), -(-len(big_pickle) // base._BZ2_BLOCK_SIZE))
+    reader, codec = base._DecompressingReader(serial)  # multi-stream: decompressed in parallel
+    self.assertEqual(codec, 'bz2')
+    self.assertIsInstance(reader.raw, base._ParallelBZ2Reader)  # type: ignore
+    with reader:  # type: ignore
+      self.assertEqual(reader.read(), big_pickle)  # type: ignore
+      self.assertEqual(reader.tell(), len(big_pickle))  # type: ignore
+    starts = [m.start() for m in base._BZ2_STREAM_START.finditer(serial)]
+    for bad_starts in ([0, 1000] + starts[1:], starts + [len(serial) - 1000]):
+      # stream headers found by chance inside compressed data are detected and skipped
+      with base.io.BufferedReader(base._ParallelBZ2Reader(serial, bad_starts)) as reader:
+        self.assertEqual(reader.read(), big_pickle)
+
+  def test_Serialize_logs(self):
+    """Test."""
+    with self.assertLogs(level=logging.INFO) as logs:  # compressed data is streamed into AES-GCM
+      serial = base.BinSerialize(self.big_obj, compress='bz2', key=self._CRYPTO_KEY)
+    self.assertIn(' encrypted (', logs.output[0])
+    self.assertIn(' pickle+bz2+aes-gcm)', logs.output[0])
+    with self.assertLogs(level=logging.INFO) as logs:
+      self.assertTupleEqual(base.BinDeSerialize(serial, key=self._CRYPTO_KEY), self.big_obj)
+    self.assertIn(' pickle+bz2+aes-gcm)', logs.output[0])
+    # logs are only formatted if they will be logged
+    logging.getLogger().setLevel(logging.WARNING)  # restored by tearDown()
+    with mock.patch.object(base, 'HumanizedBytes') as humanized_bytes:
+      with mock.patch.object(base, 'HumanizedSeconds') as humanized_secs:
+        base.BinDeSerialize(
+            base.BinSerialize([1, 2], key=self._CRYPTO_KEY), key=self._CRYPTO_KEY)
+        tmp_file = os.path.join(self.tmp_dir, 'not_logged')
+        base.BinSerialize([1, 2], file_path=tmp_file)
+        base.BinDeSerialize(file_path=tmp_file)
+        base.BinSerializeToFile([1, 2], tmp_file)
+        base.BinDeSerializeFromFile(tmp_file)
+    humanized_bytes.assert_not_called()
+    humanized_secs.assert_not_called()
+
+  def test_Serialize_buffers(self):
+    """Test."""
+    # large buffers are handed to the compressor directly by pickle protocol 5 (no copies)
+    big_buffer = bytearray(range(256)) * 1000
+    with mock.patch.object(base._CompressingWriter, 'write', autospec=True,
+                           side_effect=base._CompressingWriter.write) as writer:
+      serial = base.BinSerialize(big_buffer, compress='bz2', level=1)
+    self.assertTrue(any(call.args[1] is big_buffer for call in writer.call_args_list))
+    self.assertEqual(base.BinDeSerialize(serial), big_buffer)
+    for codec in ('none', 'bz2', 'zstd' if base.zstandard else 'none'):  # like numpy arrays do
+      serial = base.BinSerialize(
+          base.pickle.PickleBuffer(big_buffer), compress=codec, key=self._CRYPTO_KEY)
+      self.assertEqual(base.BinDeSerialize(serial, key=self._CRYPTO_KEY), big_buffer)
+
+  def test_DeSerialize_errors(self):
+    """Test."""
+    # the garbage collector is paused while unpickling, and always restored
+    self.assertTrue(gc.isenabled())
+    for codec in ('none', 'bz2'):
+      probe = base.BinDeSerialize(base.BinSerialize(_GCProbe(), compress=codec))
+      self.assertFalse(probe.gc_enabled)
+      self.assertTrue(gc.isenabled())
+    with self.assertRaisesRegex(base.Error, 'Corrupt') as cm:
+      base.BinDeSerialize(b'\x80\x05garbage')
+    self.assertIsInstance(cm.exception.__cause__, base.pickle.UnpicklingError)
+    self.assertTrue(gc.isenabled())
+    # corrupt compressed data is an Error, whatever pickle/bz2 stumbles on first
+    corrupt = bytearray(base.BinSerialize(list(range(5000)), compress='bz2'))
+    corrupt[len(corrupt) // 2] ^= 0xFF
+    with self.assertRaisesRegex(base.Error, 'Corrupt'):
+      base.BinDeSerialize(bytes(corrupt))
+    self.assertTrue(gc.isenabled())
+    # good data for a class (or module) that is gone is not corrupt: the exception goes through
+    module = sys.modules[_GCProbe.__module__]
+    tmp_file = os.path.join(self.tmp_dir, 'gone')
+    for codec in ('none', 'bz2', 'zstd' if base.zstandard else 'none'):
+      serial = base.BinSerialize(_GCProbe(), compress=codec)
+      base.BinSerializeToFile(_GCProbe(), tmp_file, compress=codec)
+      with mock.patch.dict(sys.modules, {_GCProbe.__module__: None}):
+        with self.assertRaises(ImportError):
+          base.BinDeSerialize(serial)
+        with self.assertRaises(ImportError):
+          base.BinDeSerializeFromFile(tmp_file)
+      with mock.patch.object(module, '_GCProbe'):  # restores it
+        del module._GCProbe
+        with self.assertRaises(AttributeError):
+          base.BinDeSerialize(serial)
+        with self.assertRaises(AttributeError):
+          base.BinDeSerializeFromFile(tmp_file)
+
+  def test_Serialize_file(self):
+    """Test."""
     # do compressed disk serialization test
-    with tempfile.TemporaryDirectory() as tmpdir:
-      tmp_file = os.path.join(tmpdir, f'base_test.test_Serialize.{int(time.time())}')
-      base.BinSerialize(({4: 3, 2: 1}, [None, 7]), file_path=tmp_file)
-      self.assertTupleEqual(
-          base.BinDeSerialize(file_path=tmp_file), ({4: 3, 2: 1}, [None, 7]))
+    tmp_file = os.path.join(self.tmp_dir, f'base_test.test_Serialize_file.{int(time.time())}')
+    base.BinSerialize(({4: 3, 2: 1}, [None, 7]), file_path=tmp_file)
+    self.assertTupleEqual(
+        base.BinDeSerialize(file_path=tmp_file), ({4: 3, 2: 1}, [None, 7]))
+    self.assertTupleEqual(
+        base.BinDeSerializeFromFile(tmp_file), ({4: 3, 2: 1}, [None, 7]))
+    # streamed straight to/from files
+    for codec in ('none', 'bz2', 'zstd' if base.zstandard else 'none'):
+      for key in (None, self._CRYPTO_KEY):
+        base.BinSerializeToFile(self.big_obj, tmp_file, compress=codec, key=key)
+        self.assertTupleEqual(base.BinDeSerialize(file_path=tmp_file, key=key), self.big_obj)
+        self.assertTupleEqual(base.BinDeSerializeFromFile(tmp_file, key=key), self.big_obj)
+    base.BinSerializeToFile(_GCProbe(), tmp_file)
+    self.assertFalse(base.BinDeSerializeFromFile(tmp_file).gc_enabled)
+    self.assertTrue(gc.isenabled())
+    base.BinSerializeToFile([1, 2], tmp_file, compress='bz2')  # single bz2 stream
+    self.assertListEqual(base.BinDeSerializeFromFile(tmp_file), [1, 2])
+    with self.assertRaisesRegex(base.Error, 'not found'):
+      base.BinDeSerializeFromFile(tmp_file + '.missing')
+    # a failed serialization leaves the existing file intact, and no temporary files behind
+    for codec in ('none', 'bz2'):
+      with self.assertRaises((base.pickle.PicklingError, AttributeError)):
+        base.BinSerializeToFile((self.big_obj, lambda: 0), tmp_file, compress=codec)
+      self.assertListEqual(base.BinDeSerializeFromFile(tmp_file), [1, 2])
+    self.assertListEqual(
+        [name for name in os.listdir(self.tmp_dir) if name.endswith('.tmp')], [])
+
+  @unittest.skipUnless(base.zstandard, 'zstandard module not installed')
+  def test_Serialize_zstd(self):
+    """Test."""
+    crypto_key = b'LRtw2A4U9PAtihUow5p_eQex6IYKM7nUoPlf1fkKPgc='  # cspell:disable-line
+    serial = base.BinSerialize(({1: 2, 3: 4}, [5] * 1000), compress='zstd')
+    self.assertTrue(serial.startswith(b'\x28\xb5\x2f\xfd'))
+    self.assertTupleEqual(base.BinDeSerialize(serial), ({1: 2, 3: 4}, [5] * 1000))
+    self.assertEqual(base.BinSerialize(({1: 2, 3: 4}, [5] * 1000)), serial)  # zstd is the default
+    serial = base.BinSerialize(({1: 2, 3: 4}, [5] * 1000), level=19)
+    self.assertTupleEqual(base.BinDeSerialize(serial), ({1: 2, 3: 4}, [5] * 1000))
+    with self.assertRaisesRegex(base.Error, r'level 23 is invalid for \'zstd\' \(-131072 to 22\)'):
+      base.BinSerialize([1, 2], level=23)
+    with self.assertRaisesRegex(base.Error, r'level 10 is invalid for \'bz2\' \(1 to 9\)$'):
+      base.BinSerializeToFile([1, 2], os.path.join(self.tmp_dir, 'level'), compress='bz2', level=10)
+    with mock.patch.object(base, 'zstandard', None):  # the default codec is now bz2
+      with self.assertRaisesRegex(base.Error, 'give the codec explicitly'):
+        base.BinSerialize([1, 2], level=19)
+    serial = base.BinSerialize(({1: 2, 3: 4}, [5] * 1000), compress='zstd', key=crypto_key)
+    self.assertTupleEqual(base.BinDeSerialize(serial, key=crypto_key), ({1: 2, 3: 4}, [5] * 1000))
+    with mock.patch.object(base, 'zstandard', None):
+      with self.assertRaisesRegex(base.Error, 'needs the `zstandard` module'):
+        base.BinDeSerialize(serial, key=crypto_key)
+    # compressors are reused; small data does not use worker threads, large data does
+    base.BinSerialize([1, 2], compress='zstd', level=4)
+    idle = base._ZSTD_IDLE_COMPRESSORS[(4, False)]
+    self.assertEqual(len(idle), 1)
+    compressor = idle[0]
+    base.BinSerialize([1, 2], compress='zstd', level=4)
+    self.assertListEqual(idle, [compressor])
+    self.assertNotIn((4, True), base._ZSTD_IDLE_COMPRESSORS)
+    big_obj = (list(range(10000)), b'x' * 10000)
+    with mock.patch.object(base, '_ZSTD_THREADS_MIN_SIZE', 5000):
+      serial = base.BinSerialize(big_obj, compress='zstd', level=4)
+    self.assertEqual(len(base._ZSTD_IDLE_COMPRESSORS[(4, True)]), 1)
+    self.assertTupleEqual(base.BinDeSerialize(serial), big_obj)
+    self._AssertCorruptionDetected('zstd')
+
+  def _AssertCorruptionDetected(self, codec: base.CompressionCodec) -> None:
+    """Assert flipped bits in `codec` compressed data raise an Error, in memory and from file."""
+    obj = [str(i) for i in range(20000)]
+    serial = base.BinSerialize(obj, compress=codec)
+    tmp_file = os.path.join(self.tmp_dir, f'corrupt.{codec}')
+    for position in (len(serial) // 3, len(serial) // 2, len(serial) - 1):  # last: checksum
+      corrupt = bytearray(serial)
+      corrupt[position] ^= 0x10
+      with self.assertRaises(base.Error):
+        base.BinDeSerialize(bytes(corrupt))
+      with open(tmp_file, 'wb') as file_obj:
+        file_obj.write(corrupt)
+      with self.assertRaises(base.Error):
+        base.BinDeSerializeFromFile(tmp_file)
+
+  @unittest.skipUnless(base.lz4_frame, 'lz4 module not installed')
+  def test_Serialize_lz4(self):
+    """Test."""
+    crypto_key = b'LRtw2A4U9PAtihUow5p_eQex6IYKM7nUoPlf1fkKPgc='  # cspell:disable-line
+    serial = base.BinSerialize(({1: 2, 3: 4}, [5] * 1000), compress='lz4')
+    self.assertTrue(serial.startswith(b'\x04\x22\x4d\x18'))
+    self.assertTupleEqual(base.BinDeSerialize(serial), ({1: 2, 3: 4}, [5] * 1000))
+    big_obj = (list(range(300000)), b'x' * 1000000)
+    serial = base.BinSerialize(big_obj, compress='lz4', key=crypto_key, level=9)
+    self.assertTupleEqual(base.BinDeSerialize(serial, key=crypto_key), big_obj)
+    tmp_file = os.path.join(self.tmp_dir, 'lz4')
+    base.BinSerializeToFile(big_obj, tmp_file, compress='lz4')
+    self.assertTupleEqual(base.BinDeSerializeFromFile(tmp_file), big_obj)
+    with mock.patch.object(base, 'lz4_frame', None):
+      with self.assertRaisesRegex(base.Error, 'needs the `lz4` module'):
+        base.BinSerialize([1, 2], compress='lz4')
+      with self.assertRaisesRegex(base.Error, 'needs the `lz4` module'):
+        base.BinDeSerialize(serial, key=crypto_key)
+    self._AssertCorruptionDetected('lz4')
+
+  def test_ParallelBZ2Compressor(self):
+    """Test."""
+    data = bytes(range(256)) * 100
+    with mock.patch.object(base, '_BZ2_BLOCK_SIZE', 1000):
+      compressor = base._ParallelBZ2Compressor(1)
+      compressor._max_pending = 2
+      queued: list[int] = []
+      submit = compressor._Submit
+      with mock.patch.object(compressor, '_Submit', side_effect=lambda block: (
+          queued.append(len(compressor._pending)), submit(block))):
+        # partial block, then one big write of many blocks, then a few odd sized ones
+        output = [compressor.compress(data[:500]), compressor.compress(data[500:20000])]
+        output.extend(compressor.compress(data[i:i + 777]) for i in range(20000, len(data), 777))
+        output.append(compressor.flush())
+    # 25600 bytes: 25 full blocks, plus the partial last one (unless all the others were already
+    # done by flush() time, in which case that one is compressed inline)
+    self.assertIn(len(queued), (25, 26))
+    self.assertLessEqual(max(queued), 2)  # never more than _max_pending blocks waiting
+    self.assertEqual(base.bz2.decompress(b''.join(output)), data)
+
+  def test_ParallelBZ2Reader_corrupt(self):
+    """Test."""
+    obj = [str(i) for i in range(50000)]
+    with mock.patch.object(base, '_BZ2_BLOCK_SIZE', 20000):  # many streams, read in parallel
+      serial = base.BinSerialize(obj, compress='bz2')
+    tmp_file = os.path.join(self.tmp_dir, 'corrupt.multi.bz2')
+    for position in range(100, len(serial), len(serial) // 10):
+      corrupt = bytearray(serial)
+      corrupt[position] ^= 0x10
+      with open(tmp_file, 'wb') as file_obj:  # in place: crashes tasks still on the old map
+        file_obj.write(corrupt)
+      with self.assertRaises(base.Error) as cm:  # not a BufferError from closing the file map
+        base.BinDeSerializeFromFile(tmp_file)
+      self.assertNotIsInstance(cm.exception.__cause__, BufferError)
+
+  @unittest.skipUnless(hasattr(os, 'fork'), 'no fork() in this platform')
+  def test_Serialize_fork(self):
+    """Test."""
+    big_obj = bytes(range(256)) * 100
+    with mock.patch.object(base, '_BZ2_BLOCK_SIZE', 1000):  # many streams: uses the thread pool
+      _SerializeInChild(big_obj)  # the parent's pool now has threads, that the child won't have
+      process = multiprocessing.get_context('fork').Process(
+          target=_SerializeInChild, args=(big_obj,))
+      process.start()
+      process.join(timeout=30)
+    if process.is_alive():
+      process.kill()
+      self.fail('Forked child hung using the compression thread pool')
+    self.assertEqual(process.exitcode, 0)
+
+  def test_Serialize_random(self):
+    """Test."""
+    rng = random.Random(42)  # seeded: failures can be reproduced
+    codecs = ['none', 'bz2'] + [
+        codec for codec, module in (('zstd', base.zstandard), ('lz4', base.lz4_frame)) if module]
+    for size in (0, 1, 10, 100, 1000, 10000):
+      obj = {rng.randrange(-2 ** 40, 2 ** 40): (rng.random(), rng.randbytes(rng.randrange(50)))
+             for _ in range(size)}
+      for codec in codecs:
+        for key in (None, self._CRYPTO_KEY):
+          self.assertDictEqual(
+              base.BinDeSerialize(base.BinSerialize(obj, compress=codec, key=key), key=key), obj,
+              msg=f'{size} {codec} {key is not None}')
+    for _ in range(100):
+      block = rng.randbytes(32)
+      self.assertEqual(
+          self.block_encoder.DecryptBlock256(self.block_encoder.EncryptBlock256(block)), block)
 
   def test_Timed(self):
     """Test."""
     with base.Timer() as tm:
       with self.assertRaises(base.Error):
         _ = tm.delta
-    tm._start, tm._end = 1455237912.5451021, 1455237944.955657
-    self.assertEqual(tm.readable, '32.41 secs')
-    tm._end = tm._start + 1000
-    self.assertEqual(tm.readable, '16.67 mins')
-    tm._end = tm._start + 10000
-    self.assertEqual(tm.readable, '2.78 hours')
+    tm._start_ns, tm._end_ns = 1455237912545102100, 1455237944955657000
+    self.assertAlmostEqual(tm.delta, 32.4105549, places=6)
+    self.assertEqual(tm.readable, '32.41 secs')  # formats are tested in test_HumanizedSeconds
+    for secs in (1000, 10000):
+      tm._end_ns = tm._start_ns + secs * 1000000000
+      self.assertEqual(tm.delta, float(secs))  # exact: computed in integer nanoseconds
+      self.assertEqual(tm.readable, base.HumanizedSeconds(tm.delta))
+    with base.Timer() as tm:
+      pass
+    self.assertGreaterEqual(tm.delta, 0.0)
+    self.assertIsInstance(tm._start_ns, int)
+    with self.assertRaises(AttributeError):
+      tm.foo = 1  # type: ignore  # pylint: disable=attribute-defined-outside-init
 
     @base.Timed('empty method')
     def _tm():
       pass
 
-    _tm()
+    with self.assertLogs(level=logging.INFO) as logs:
+      _tm()
+    self.assertEqual(len(logs.output), 1)
+    self.assertIn("'empty method' execution time: ", logs.output[0])
+    # time is only formatted if it will be logged
+    logging.getLogger().setLevel(logging.WARNING)  # restored by tearDown()
+    with mock.patch.object(base, 'HumanizedSeconds') as humanized:
+      with base.Timer():
+        pass
+      with base.Timer(log='not logged'):
+        pass
+      _tm()
+      humanized.assert_not_called()
 
 
 SUITE = unittest.TestLoader().loadTestsFromTestCase(TestBase)
+# run_all_tests.py starts these first when running in parallel
+SLOW_TESTS = (
+    'test_Serialize_file', 'test_DeriveKeyFromStaticPassword',
+    'test_DeriveKeyFromStaticPassword_Jedi', 'test_Serialize_bz2_parallel')
 
 
 if __name__ == '__main__':
-  unittest.main()
+  if len(sys.argv) > 1:
+    unittest.main()  # specific tests or unittest flags were asked for
+  else:
+    from baselib import run_all_tests  # pylint: disable=import-outside-toplevel
+    run_all_tests.RunModuleTests(run_all_tests.base_test)  # in parallel, slow tests first
@@ -4,31 +4,86 @@
 #
 """Run all the tests so we can have easy global coverage."""
 
+import concurrent.futures
 import logging
+import os
+import unittest
 
 from baselib import base
 from baselib import base_test
 
 __author__ = 'balparda@gmail.com (Daniel Balparda)'
-__version__ = (1, 0)
+__version__ = (1, 1)
 
 
 _TEST_MODULES_TO_RUN = (
     base_test,
 )
+_BANNER: str = '*' * 80
+
+
+def _RunTests(test_ids: list[str]) -> list[str]:
+  """Run tests as one suite (in a worker process), raising on failure like SUITE.debug() does.
+
+  Running them together means the class fixtures (setUpClass) are built once for the whole group,
+  not once per test.
+  """
+  suite = unittest.TestSuite()
+  for test_id in test_ids:
+    # addTests() adds the test itself, not the one test suite: a flat suite, for the fixtures
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromName(test_id))
+  suite.debug()
+  return test_ids
+
+
+def _TestIds(module) -> list[str]:
+  """All test IDs in `module.SUITE`, the ones in `module.SLOW_TESTS` first.
+
+  Slow tests are scheduled first so no worker is left running a long test after all the others
+  are done; otherwise the suite order is kept.
+  """
+  slow: set[str] = set(getattr(module, 'SLOW_TESTS', ()))
+  ids: list[str] = [test.id() for test in module.SUITE]
+  return sorted(ids, key=lambda i: i.rsplit('.', 1)[-1] not in slow)
+
+
+def RunModuleTests(module, workers: int = 0) -> None:
+  """Run all tests in `module.SUITE`, raising on the first failure like SUITE.debug() does.
+
+  The tests are dealt round-robin (slow ones first, see _TestIds()) into one group per worker,
+  and each group runs as a single suite, so class fixtures are built once per worker.
+
+  Args:
+    module: test module, with a SUITE (and optionally SLOW_TESTS)
+    workers: (default 0) number of worker processes; 0 is one per CPU; with only 1 worker the
+        tests run sequentially in this process
+  """
+  workers = workers or os.cpu_count() or 1
+  logging.info('Running tests: %s.py (%d workers)', module.__name__, workers)
+  if workers == 1:
+    module.SUITE.debug()
+    return
+  test_ids: list[str] = _TestIds(module)
+  groups: list[list[str]] = [test_ids[i::workers] for i in range(min(workers, len(test_ids)))]
+  with concurrent.futures.ProcessPoolExecutor(max_workers=len(groups)) as executor:
+    for _ in executor.map(_RunTests, groups):
+      pass  # any failure is re-raised here
 
 
 @base.Timed('Total baselib package test time')
-def Main():
-  """Run all of the tests."""
-  logging.info('*' * 80)
+def Main(workers: int = 0):
+  """Run all of the tests.
+
+  Args:
+    workers: (default 0) number of worker processes; see RunModuleTests()
+  """
+  logging.info(_BANNER)
   for module in _TEST_MODULES_TO_RUN:
-    logging.info('Running tests: %s.py', module.__name__)
-    module.SUITE.debug()
+    RunModuleTests(module, workers=workers)
     logging.info('OK')
-    logging.info('*' * 80)
+    logging.info(_BANNER)
   logging.info('               ======>>>>  ALL MODULES PASSED OK  <<<<======')
-  logging.info('*' * 80)
+  logging.info(_BANNER)
   return 0
 
 
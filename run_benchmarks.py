@@ -0,0 +1,122 @@
+#!/usr/bin/python3 -bb
+#
+# Copyright 2023 Daniel Balparda (balparda@gmail.com)
+#
+"""Benchmark the compute-heavy baselib paths, optionally saving/comparing against a baseline.
+
+The tests only check correctness; timings are measured here, with repeated rounds, so numbers
+are stable enough to compare between versions:
+
+  ./run_benchmarks.py --save baseline.json     # on the old version
+  ./run_benchmarks.py --compare baseline.json  # on the new one: exit code 1 if anything regressed
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import timeit
+from typing import Callable, Optional
+
+from baselib import base
+
+__author__ = 'balparda@gmail.com (Daniel Balparda)'
+__version__ = (1, 0)
+
+
+_ROUNDS: int = 5              # timing rounds per benchmark; the best (min) round is reported
+_REGRESSION_RATIO: float = 1.2  # slower than baseline by this factor is flagged as a regression
+_KEY: bytes = b'LRtw2A4U9PAtihUow5p_eQex6IYKM7nUoPlf1fkKPgc='  # cspell:disable-line
+_DATA_1K: bytes = os.urandom(1024)
+_DATA_1M: bytes = os.urandom(1024 * 1024)
+_OBJ: dict[int, list[str]] = {i: [str(j) for j in range(50)] for i in range(1000)}
+_SIZES_100: list[int] = [int.from_bytes(os.urandom(5), 'big') for _ in range(100)]
+_SIZES_10K: list[int] = [int.from_bytes(os.urandom(5), 'big') for _ in range(10000)]
+_HUMANIZED_BYTES = base.HumanizedBytes.__wrapped__  # type: ignore  # uncached: formatting cost
+
+
+def _DeriveKey() -> bytes:
+  """Uncached DeriveKeyFromStaticPassword()."""
+  base.ClearKeyCache()
+  return base.DeriveKeyFromStaticPassword('luke')
+
+
+_SERIAL: bytes = base.BinSerialize(_OBJ)
+_SERIAL_ENCRYPTED: bytes = base.BinSerialize(_OBJ, key=_KEY)
+_CIPHER_1K: bytes = base.Encrypt(_DATA_1K, _KEY)
+
+# name -> zero-argument callable to time
+_BENCHMARKS: dict[str, Callable[[], object]] = {
+    'DeriveKeyFromStaticPassword': _DeriveKey,
+    'Encrypt(1kb)': lambda: base.Encrypt(_DATA_1K, _KEY),
+    'Decrypt(1kb)': lambda: base.Decrypt(_CIPHER_1K, _KEY),
+    'BytesHexHash(1Mb)': lambda: base.BytesHexHash(_DATA_1M),
+    'BinSerialize': lambda: base.BinSerialize(_OBJ),
+    'BinDeSerialize': lambda: base.BinDeSerialize(_SERIAL),
+    'BinSerialize(key)': lambda: base.BinSerialize(_OBJ, key=_KEY),
+    'BinDeSerialize(key)': lambda: base.BinDeSerialize(_SERIAL_ENCRYPTED, key=_KEY),
+    # scalar vs vectorized formatting, on both sides of the break-even size
+    'HumanizedBytes(100x)': lambda: [_HUMANIZED_BYTES(s) for s in _SIZES_100],
+    'HumanizedBytes(10000x)': lambda: [_HUMANIZED_BYTES(s) for s in _SIZES_10K],
+}
+if base.np is not None:
+  _SIZES_100_ARRAY = base.np.array(_SIZES_100)
+  _SIZES_10K_ARRAY = base.np.array(_SIZES_10K)
+  _BENCHMARKS['HumanizedBytesArray(100)'] = lambda: base.HumanizedBytesArray(_SIZES_100_ARRAY)
+  _BENCHMARKS['HumanizedBytesArray(10000)'] = lambda: base.HumanizedBytesArray(_SIZES_10K_ARRAY)
+
+
+def _Time(method: Callable[[], object]) -> float:
+  """Best per-call time, in seconds, over _ROUNDS rounds (each one about 0.2 secs or 1 call)."""
+  timer = timeit.Timer(method)
+  number, _ = timer.autorange()
+  return min(timer.repeat(repeat=_ROUNDS, number=number)) / number
+
+
+@base.Timed('Total baselib benchmark time')
+def Main(save: Optional[str] = None, compare: Optional[str] = None) -> int:
+  """Run all benchmarks.
+
+  Args:
+    save: (default None) if given, JSON file path to save the results to (a new baseline)
+    compare: (default None) if given, JSON file path of a baseline to compare results against
+
+  Returns:
+    0 if OK, 1 if some benchmark regressed against the `compare` baseline
+  """
+  baseline: dict[str, float] = {}
+  if compare:
+    with open(compare, 'rt', encoding='utf-8') as file_obj:
+      baseline = json.load(file_obj)
+  root_logger = logging.getLogger()
+  old_level: int = root_logger.level
+  root_logger.setLevel(logging.WARNING)  # the benchmarked methods log at INFO level
+  results: dict[str, float] = {}
+  regressed: list[str] = []
+  for name, method in _BENCHMARKS.items():
+    results[name] = _Time(method)
+    line: str = f'{name:>30}: {base.HumanizedSeconds(results[name])}'
+    if name in baseline:
+      ratio: float = results[name] / baseline[name]
+      line += f' ({ratio:0.2f}x baseline)'
+      if ratio > _REGRESSION_RATIO:
+        regressed.append(name)
+        line += ' <<< REGRESSION'
+    print(line)
+  if save:
+    with open(save, 'wt', encoding='utf-8') as file_obj:
+      json.dump(results, file_obj, indent=4)
+  root_logger.setLevel(old_level)
+  if regressed:
+    logging.error('Regressed: %s', ', '.join(regressed))
+    return 1
+  return 0
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description=__doc__.split('\n', 1)[0])
+  parser.add_argument('--save', help='save results as JSON to this file (new baseline)')
+  parser.add_argument('--compare', help='compare against this baseline JSON file')
+  args = parser.parse_args()
+  sys.exit(Main(save=args.save, compare=args.compare))
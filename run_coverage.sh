@@ -4,9 +4,12 @@
 #
 # https://coverage.readthedocs.io/
 #
+# run_all_tests.py runs the tests in worker processes, so each process writes its own data file
+# and they get combined before reporting (--omit is given to report because command-line options
+# do not reach the worker processes)
+#
 
-coverage run \
-    --omit=*_test.py,*_tests.py,*/__init__.py,*/dist-packages/* \
-    run_all_tests.py
-coverage report -m
-coverage html
+coverage run --concurrency=multiprocessing run_all_tests.py
+coverage combine
+coverage report -m --omit=*_test.py,*_tests.py,*/__init__.py,*/dist-packages/*
+coverage html --omit=*_test.py,*_tests.py,*/__init__.py,*/dist-packages/*